@@ -1,7 +1,24 @@
 import tkinter as tk
 from tkinter import filedialog
 import cv2
-from PIL import Image, ImageTk
+from dataflow import Node, SourceNode
+from frame_source import ThreadedFrameSource
+from lut_cache import apply_lut, threshold_table
+from preview import make_proxy
+from tk_display import ImageDisplay
+
+
+def to_gray(image):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def canny_edges(gray, threshold):
+    return cv2.Canny(gray, threshold, threshold * 2)
+
+
+def binary_threshold(gray, threshold):
+    return apply_lut(gray, threshold_table(threshold))
+
 
 class ImageProcessingApp(tk.Tk):
     def __init__(self):
@@ -14,6 +31,8 @@ class ImageProcessingApp(tk.Tk):
 
         self.canvas2 = tk.Canvas(self, width=400, height=400)
         self.canvas2.grid(row=0, column=1)
+        self.display1 = ImageDisplay(self.canvas1)
+        self.display2 = ImageDisplay(self.canvas2)
 
         self.load_button = tk.Button(self, text="Load", command=self.load_image)
         self.load_button.grid(row=1, column=0)
@@ -39,7 +58,32 @@ class ImageProcessingApp(tk.Tk):
         self.play_button = tk.Button(self, text="Stop", command=self.play_video)
         self.play_button.grid(row=3, column=2)
 
+        # Счетчики потерянных кадров и задержки видео
+        self.stats_label = tk.Label(self, text="")
+        self.stats_label.grid(row=4, column=0, columnspan=3)
+
+        # Включение и отключение ветвей обработки
+        self.canny_enabled = tk.BooleanVar(value=True)
+        self.canny_check = tk.Checkbutton(self, text="Canny", variable=self.canny_enabled,
+                                          command=self.update_branches)
+        self.canny_check.grid(row=5, column=0)
+        self.threshold_enabled = tk.BooleanVar(value=True)
+        self.threshold_check = tk.Checkbutton(self, text="Threshold", variable=self.threshold_enabled,
+                                              command=self.update_branches)
+        self.threshold_check.grid(row=5, column=1)
+
+        # Dataflow: the frame is converted to grayscale once for both branches, and a branch is
+        # recomputed only when the frame or its parameter has changed
+        self.source = SourceNode()
+        self.gray = Node(to_gray, self.source)
+        self.canny = Node(canny_edges, self.gray, threshold=0.0)
+        self.threshold = Node(binary_threshold, self.gray, threshold=0.0)
+        # Versions of the branch results shown on the canvases
+        self.shown_versions = {}
+
         self.current_image = None
+        # Downscaled copy that fits the canvas; the filters are previewed on it
+        self.preview_image = None
         self.video_capture = None
 
     # Метод для загрузки изображения
@@ -47,60 +91,77 @@ class ImageProcessingApp(tk.Tk):
         file_path = filedialog.askopenfilename(filetypes=[("Img", "*.jpg;*.jpeg;*.png")])
         if file_path:
             self.current_image = cv2.imread(file_path)
+            self.preview_image = make_proxy(self.current_image)
             self.display_image()
 
     # Метод для обработки изображения
     def process_image(self):
-        if self.current_image is not None:
-            canny_threshold = self.canny_threshold_var.get()
-            threshold = self.threshold_var.get()
-
-            # Применяем фильтр Кэнни и пороговый фильтр
-            canny_image = cv2.Canny(self.current_image, canny_threshold, canny_threshold * 2)
-            _, threshold_image = cv2.threshold(self.current_image, threshold, 255, cv2.THRESH_BINARY)
-
-            self.display_processed_images(canny_image, threshold_image)
+        if self.preview_image is not None:
+            self.source.set(self.preview_image)
+            self.update_outputs()
+
+    # Метод для пересчета ветвей, у которых изменился кадр или параметры
+    def update_outputs(self):
+        # Параметры читаются один раз на кадр
+        self.canny.set_params(threshold=self.canny_threshold_var.get())
+        self.threshold.set_params(threshold=self.threshold_var.get())
+
+        # Применяем фильтр Кэнни и пороговый фильтр
+        canny_image = self.canny.evaluate()
+        threshold_image = self.threshold.evaluate()
+        # Only the branches with new results are drawn again
+        self.display_processed_images(canny_image if self.is_new(self.canny) else None,
+                                      threshold_image if self.is_new(self.threshold) else None)
+
+    def is_new(self, node):
+        if node.value is None or self.shown_versions.get(node) == node.version:
+            return False
+        self.shown_versions[node] = node.version
+        return True
+
+    def update_branches(self):
+        self.canny.enabled = self.canny_enabled.get()
+        self.threshold.enabled = self.threshold_enabled.get()
+        for node, display in ((self.canny, self.display1), (self.threshold, self.display2)):
+            if not node.enabled:
+                display.clear()
+            # A branch that is enabled again is drawn on the next update
+            self.shown_versions.pop(node, None)
+        if self.source.value is not None:
+            self.update_outputs()
 
     # Метод для захвата видеопотока
     def capture_video(self):
-        self.video_capture = cv2.VideoCapture(0)
+        if self.video_capture is not None:
+            self.video_capture.release()
+        # Кадры читаются в отдельном потоке, интерфейс всегда получает самый новый кадр
+        self.video_capture = ThreadedFrameSource(0).start()
         self.play_video()
 
     # Метод для воспроизведения видео
     def play_video(self):
         if self.video_capture is not None:
-            ret, frame = self.video_capture.read()
-            if ret:
-                canny_image = cv2.Canny(frame, self.canny_threshold_var.get(), self.canny_threshold_var.get() * 2)
-                _, threshold_image = cv2.threshold(frame, self.threshold_var.get(), 255, cv2.THRESH_BINARY)
-                self.display_processed_images(canny_image, threshold_image)
-                self.after(10, self.play_video)
+            if self.video_capture.is_finished():
+                return
+            frame = self.video_capture.read()
+            if frame is not None:
+                # Frames are filtered at the size they are shown at
+                self.source.set(make_proxy(frame))
+                self.stats_label.config(text=self.video_capture.stats_text())
+            # Without a new frame only a changed parameter causes any work
+            self.update_outputs()
+            self.after(10, self.play_video)
 
     # Метод для отображения изображения
     def display_image(self):
-        if self.current_image is not None:
-            # Преобразуем изображение из OpenCV в PIL
-            pil_image = Image.fromarray(cv2.cvtColor(self.current_image, cv2.COLOR_BGR2RGB))
-            # Создаем объект Tkinter.PhotoImage из PIL-изображения
-            photo = ImageTk.PhotoImage(pil_image)
-            self.canvas1.create_image(0, 0, anchor=tk.NW, image=photo)
-            self.canvas1.image = photo
-
-    # Метод для отображения обработанных изображений
-    def display_processed_images(self, canny_image, threshold_image):
-        # Преобразуем изображения из OpenCV в PIL
-        pil_canny_image = Image.fromarray(cv2.cvtColor(canny_image, cv2.COLOR_GRAY2RGB))
-        pil_threshold_image = Image.fromarray(cv2.cvtColor(threshold_image, cv2.COLOR_BGR2RGB))
+        if self.preview_image is not None:
+            self.display1.show(self.preview_image)
 
-        # Создаем объекты Tkinter.PhotoImage из PIL-изображений
-        canny_photo = ImageTk.PhotoImage(pil_canny_image)
-        threshold_photo = ImageTk.PhotoImage(pil_threshold_image)
-
-        self.canvas1.create_image(0, 0, anchor=tk.NW, image=canny_photo)
-        self.canvas1.image = canny_photo
-
-        self.canvas2.create_image(0, 0, anchor=tk.NW, image=threshold_photo)
-        self.canvas2.image = threshold_photo
+    # Метод для отображения обработанных изображений (None - изображение не изменилось)
+    def display_processed_images(self, canny_image, threshold_image):
+        for image, display in ((canny_image, self.display1), (threshold_image, self.display2)):
+            if image is not None:
+                display.show(image)
 
 if __name__ == "__main__":
     app = ImageProcessingApp()
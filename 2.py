@@ -1,8 +1,53 @@
+import argparse
+import ast
+import glob
+import os
+import sys
+import traceback
 import tkinter as tk
 from tkinter import filedialog
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
+from lut_cache import apply_lut, brightness_contrast_table
+from preview import make_proxy
+from tk_display import ImageDisplay
+from pixel_pipeline import (SEPIA_KERNEL, PixelPipeline, StepOp, brightness_contrast_op, channel_op,
+                            grayscale_op, hsv_op, hsv_shift, sepia_op)
+from tiled_filters import create_output, kernel_halo, map_image, run_tiled
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp', '.ppm', '.pgm')
+
+# Operations of the batch mode: name -> ImageProcessor method
+BATCH_OPERATIONS = {
+    "display_channel": "display_channel",
+    "grayscale": "grayscale",
+    "sepia": "sepia",
+    "brightness_contrast": "brightness_contrast",
+    "logical": "logical_operations",
+    "hsv": "hsv_transformation",
+    "median_blur": "median_blur",
+    "window_filter": "window_filter",
+    "watercolor": "watercolor",
+    "cartoon": "cartoon",
+}
+# Operations that also need the second image
+BINARY_OPERATIONS = ("logical", "watercolor")
+# Neighbourhood operations that can be run tile by tile on images that do not fit in memory
+TILED_OPERATIONS = ("median_blur", "window_filter", "cartoon")
+# Parameters accepted by the batch operations (window_filter takes the size of a box kernel)
+OPERATION_PARAMS = {
+    "display_channel": ("channel",),
+    "grayscale": (),
+    "sepia": (),
+    "brightness_contrast": ("brightness", "contrast"),
+    "logical": ("operation",),
+    "hsv": ("hue", "saturation", "value"),
+    "median_blur": ("kernel_size",),
+    "window_filter": ("kernel_size",),
+    "watercolor": ("brightness", "contrast", "blend"),
+    "cartoon": ("threshold",),
+}
 
 # Класс для обработки изображений
 class ImageProcessor:
@@ -24,16 +69,13 @@ class ImageProcessor:
         return gray_image
 
     def sepia(self, image):
-        kernel = np.array([[0.272, 0.534, 0.131],
-                           [0.349, 0.686, 0.168],
-                           [0.393, 0.769, 0.189]])
-        sepia_image = cv2.transform(image, kernel)
+        sepia_image = cv2.transform(image, SEPIA_KERNEL)
         return sepia_image
 
+    # Same result as cv2.convertScaleAbs(image, alpha=(contrast + 100) / 100, beta=brightness),
+    # but through a cached lookup table
     def brightness_contrast(self, image, brightness=0, contrast=0):
-        alpha = (contrast + 100) / 100.0
-        beta = brightness
-        adjusted_image = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+        adjusted_image = apply_lut(image, brightness_contrast_table(brightness, contrast))
         return adjusted_image
 
     def logical_operations(self, image1, image2, operation):
@@ -47,12 +89,9 @@ class ImageProcessor:
             result_image = cv2.bitwise_not(image1)
         return result_image
 
+    # One lookup per pixel for all three HSV channels; the sums are done in the table without uint8 overflow
     def hsv_transformation(self, image, hue=0, saturation=0, value=0):
-        hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        hsv_image[:, :, 0] = (hsv_image[:, :, 0] + hue) % 180
-        hsv_image[:, :, 1] = np.clip(hsv_image[:, :, 1] + saturation, 0, 255)
-        hsv_image[:, :, 2] = np.clip(hsv_image[:, :, 2] + value, 0, 255)
-        transformed_image = cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
+        transformed_image = hsv_shift(image, hue, saturation, value)
         return transformed_image
 
     def median_blur(self, image, kernel_size=3):
@@ -75,6 +114,49 @@ class ImageProcessor:
         cartoon_image = cv2.bitwise_and(cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR), image)
         return cartoon_image
 
+    # Method to get the halo (in pixels) a tile needs for the operation to give seam-free results
+    def tiled_halo(self, operation, **params):
+        if operation == "median_blur":
+            return kernel_halo(params.get("kernel_size", 3))
+        if operation == "window_filter":
+            return kernel_halo(np.asarray(params["kernel"]).shape)
+        if operation == "cartoon":
+            # medianBlur 5x5, then adaptiveThreshold over 9x9 blocks of the blurred image
+            return kernel_halo(5) + kernel_halo(9)
+        raise ValueError("Operation {} can not be run by tiles".format(operation))
+
+    # Method to run median_blur, window_filter or cartoon on a large image tile by tile in parallel
+    # The input is memory-mapped where the format allows (see tiled_filters.map_image) and the result
+    # is written to a memory-mapped .npy file, so the image never has to fit in RAM.
+    # The file is written under a temporary name and renamed only when every tile succeeded,
+    # so a failed run does not leave an uninitialised .npy that looks like a result.
+    def process_tiled(self, input_path, output_path, operation, tile_size=2048, workers=None, **params):
+        source = map_image(input_path)
+        method = getattr(self, operation)
+        halo = self.tiled_halo(operation, **params)
+        tmp_path = output_path + '.tmp.npy' if output_path is not None else None
+        output = create_output(source.shape, source.dtype, tmp_path)
+        try:
+            run_tiled(lambda tile: method(tile, **params), source, output, halo, tile_size, workers)
+        except BaseException as e:
+            if tmp_path is not None:
+                # The mapping must be closed before the file is removed (Windows), and the frames
+                # of the traceback still refer to it
+                traceback.clear_frames(e.__traceback__)
+                del output
+                os.remove(tmp_path)
+            raise
+        if tmp_path is None:
+            return output
+        del output
+        os.replace(tmp_path, output_path)
+        return np.load(output_path, mmap_mode='r')
+
+    # Method to compose a chain of point-wise operations (pixel_pipeline: sepia_op, grayscale_op,
+    # channel_op, hsv_op, brightness_contrast_op, invert_op) into the fewest passes over the image
+    def pipeline(self, *operations):
+        return PixelPipeline(operations)
+
 class ImageProcessingApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -88,6 +170,9 @@ class ImageProcessingApp(tk.Tk):
         self.canvas2 = tk.Canvas(self, width=400, height=400)
         self.canvas2.grid(row=0, column=1)
 
+        # One display (PhotoImage and canvas item) per canvas, updated in place
+        self.displays = {self.canvas1: ImageDisplay(self.canvas1), self.canvas2: ImageDisplay(self.canvas2)}
+
         self.load_button1 = tk.Button(self, text="Load Image 1", command=lambda: self.load_image(1))
         self.load_button1.grid(row=1, column=0)
 
@@ -97,12 +182,20 @@ class ImageProcessingApp(tk.Tk):
         self.apply_button = tk.Button(self, text="Apply", command=self.apply_operation)
         self.apply_button.grid(row=1, column=2)
 
+        self.save_button = tk.Button(self, text="Save Result", command=self.save_result)
+        self.save_button.grid(row=2, column=2)
+
         self.selected_operation = tk.StringVar()
         self.operation_menu = tk.OptionMenu(self, self.selected_operation, *self.get_operation_list())
-        self.operation_menu.grid(row=2, column=0, columnspan=3)
+        self.operation_menu.grid(row=2, column=0, columnspan=2)
 
         self.image1 = None
         self.image2 = None
+        # Operations are previewed on downscaled copies that fit the canvases;
+        # the full-resolution images are processed only by save_result
+        self.preview1 = None
+        self.preview2 = None
+        self.applied_operation = None
         self.selected_operation.set(self.get_operation_list()[0])
 
     def load_image(self, image_num):
@@ -111,45 +204,60 @@ class ImageProcessingApp(tk.Tk):
             image = self.processor.load_image(file_path)
             if image_num == 1:
                 self.image1 = image
-                self.display_image(self.image1, self.canvas1)
+                self.preview1 = make_proxy(image)
+                self.display_image(self.preview1, self.canvas1)
             else:
                 self.image2 = image
-                self.display_image(self.image2, self.canvas2)
+                self.preview2 = make_proxy(image)
+                self.display_image(self.preview2, self.canvas2)
 
     def apply_operation(self):
         operation = self.selected_operation.get()
+        processed_image = self.run_operation(operation, self.preview1, self.preview2)
+        self.applied_operation = operation
+        if processed_image is not None:
+            self.display_image(processed_image, self.canvas2)
+        else:
+            print("Error processing image.")
+
+    # Method to run the operation selected in the menu on a pair of images (previews or full size)
+    def run_operation(self, operation, image1, image2):
+        processed_image = None
         if operation == "Display Channel":
             channel = "Red"  
-            processed_image = self.processor.display_channel(self.image1, channel)
+            processed_image = self.processor.display_channel(image1, channel)
         elif operation == "Grayscale":
-            processed_image = self.processor.grayscale(self.image1)
+            processed_image = self.processor.grayscale(image1)
         elif operation == "Sepia":
-            processed_image = self.processor.sepia(self.image1)
+            processed_image = self.processor.sepia(image1)
         elif operation == "Brightness and Contrast":
-            processed_image = self.processor.brightness_contrast(self.image1, brightness=10, contrast=10)  
+            processed_image = self.processor.brightness_contrast(image1, brightness=10, contrast=10)  
         elif operation == "Logical Operations":
-            processed_image = self.processor.logical_operations(self.image1, self.image2, "AND")  
+            processed_image = self.processor.logical_operations(image1, image2, "AND")  
         elif operation == "HSV Transformation":
-            processed_image = self.processor.hsv_transformation(self.image1, hue=20, saturation=50, value=50)  
+            processed_image = self.processor.hsv_transformation(image1, hue=20, saturation=50, value=50)  
         elif operation == "Median Blur":
-            processed_image = self.processor.median_blur(self.image1, kernel_size=5)  
+            processed_image = self.processor.median_blur(image1, kernel_size=5)  
         elif operation == "Window Filter":
             kernel = np.ones((3, 3), dtype=np.float32) / 9
-            processed_image = self.processor.window_filter(self.image1, kernel)
+            processed_image = self.processor.window_filter(image1, kernel)
         elif operation == "Watercolor":
-            processed_image = self.processor.watercolor(self.image1, self.image2, brightness=10, contrast=10, blend=0.5)  
+            processed_image = self.processor.watercolor(image1, image2, brightness=10, contrast=10, blend=0.5)  
         elif operation == "Cartoon":
-            processed_image = self.processor.cartoon(self.image1, threshold=10)  
-        if processed_image is not None:
-            self.display_image(processed_image, self.canvas2)
-        else:
-            print("Error processing image.")
+            processed_image = self.processor.cartoon(image1, threshold=10)  
+        return processed_image
+
+    # Method to save the result of the last applied operation, rendered again at full resolution
+    def save_result(self):
+        if self.applied_operation is None:
+            return
+        file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")])
+        if file_path:
+            processed_image = self.run_operation(self.applied_operation, self.image1, self.image2)
+            cv2.imwrite(file_path, processed_image)
 
     def display_image(self, image, canvas):
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        photo = ImageTk.PhotoImage(pil_image)
-        canvas.create_image(0, 0, anchor=tk.NW, image=photo)
-        canvas.image = photo
+        self.displays[canvas].show(image)
 
     def get_operation_list(self):
         return [
@@ -165,6 +273,267 @@ class ImageProcessingApp(tk.Tk):
             "Cartoon"
         ]
 
-if __name__ == "__main__":
+# Headless batch mode
+# Every process of the pool keeps its own processor, the compiled chain of operations and the second image
+worker_processor = None
+worker_pipeline = None
+worker_second_image = None
+worker_settings = None
+
+
+# Function to read an image; np.fromfile + imdecode also works with non-ASCII paths on Windows
+def read_image(path, flags=cv2.IMREAD_COLOR):
+    data = np.fromfile(path, dtype=np.uint8)
+    return cv2.imdecode(data, flags) if data.size else None
+
+
+# Function to get the encoding parameters of cv2.imencode for the output extension
+def encode_params(extension, quality, png_compression):
+    if extension in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if extension == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, quality]
+    if extension == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return []
+
+
+# Function to build the chain of operations as a PixelPipeline, so that consecutive lookup-table
+# operations (brightness/contrast) are merged into one pass and applied in place
+# operations - list of (name, parameters)
+def build_batch_pipeline(processor, operations, second_image_getter):
+    pipeline = PixelPipeline()
+    for name, params in operations:
+        if name == "display_channel":
+            pipeline.add(channel_op(params.get("channel", "Red")))
+        elif name == "grayscale":
+            pipeline.add(grayscale_op())
+        elif name == "sepia":
+            pipeline.add(sepia_op())
+        elif name == "brightness_contrast":
+            pipeline.add(brightness_contrast_op(params.get("brightness", 0), params.get("contrast", 0)))
+        elif name == "hsv":
+            pipeline.add(hsv_op(params.get("hue", 0), params.get("saturation", 0), params.get("value", 0)))
+        elif name == "window_filter":
+            size = params.get("kernel_size", 3)
+            kernel = np.ones((size, size), dtype=np.float32) / (size * size)
+            pipeline.add(StepOp(name, lambda image, kernel=kernel: processor.window_filter(image, kernel)))
+        elif name in BINARY_OPERATIONS:
+            method = getattr(processor, BATCH_OPERATIONS[name])
+            pipeline.add(StepOp(name, lambda image, method=method, params=params:
+                                method(image, second_image_getter(image), **params)))
+        else:
+            method = getattr(processor, BATCH_OPERATIONS[name])
+            pipeline.add(StepOp(name, lambda image, method=method, params=params: method(image, **params)))
+    return pipeline
+
+
+def init_batch_worker(operations, second_path, extension, quality, png_compression):
+    global worker_processor, worker_pipeline, worker_second_image, worker_settings
+    worker_processor = ImageProcessor()
+    worker_second_image = read_image(second_path) if second_path else None
+    worker_pipeline = build_batch_pipeline(worker_processor, operations, second_image_for)
+    worker_settings = (extension, encode_params(extension, quality, png_compression))
+
+
+# Function to get the second image at the size of the current one (catalogue images differ in size)
+def second_image_for(image):
+    height, width = image.shape[:2]
+    if worker_second_image.shape[:2] != (height, width):
+        return cv2.resize(worker_second_image, (width, height), interpolation=cv2.INTER_AREA)
+    return worker_second_image
+
+
+# Function for the pool: read, process and encode one image into output_file; returns (path, error)
+def process_batch_image(path, output_file):
+    extension, params = worker_settings
+    image = read_image(path)
+    if image is None:
+        return path, "failed to read"
+    # One bad image (wrong number of channels, size, parameters) must not stop the whole batch
+    try:
+        result = worker_pipeline(image)
+    except (cv2.error, TypeError, ValueError) as e:
+        return path, str(e)
+    ok, encoded = cv2.imencode(extension, result, params)
+    if not ok:
+        return path, "failed to encode"
+    try:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        encoded.tofile(output_file)
+    except OSError as e:
+        return path, str(e)
+    return path, None
+
+
+# Function to iterate over the image files of a directory or a glob pattern
+# The files are not collected into a list, so huge directories are streamed
+def iter_images(source):
+    if os.path.isdir(source):
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield entry.path
+    else:
+        for path in glob.iglob(source, recursive=True):
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                yield path
+
+
+# Function to get the directory the output tree mirrors: the common directory of all sources
+# (for a glob pattern - the part before the first wildcard)
+def batch_root(sources):
+    roots = []
+    for source in sources:
+        root = source if os.path.isdir(source) else os.path.dirname(source)
+        while glob.has_magic(root):
+            root = os.path.dirname(root)
+        roots.append(os.path.abspath(root or os.curdir))
+    return os.path.commonpath(roots)
+
+
+# Function to get the output file of an image: its path relative to root with the output extension added,
+# e.g. root/a/photo.png -> output/a/photo.png.jpg, so images with the same name (in different
+# directories or with different extensions) do not overwrite each other
+def output_file_for(path, root, output_dir, extension):
+    return os.path.join(output_dir, os.path.relpath(os.path.abspath(path), root) + extension)
+
+
+# Function to run one neighbourhood operation over large images tile by tile; the images are processed
+# one after another, the tiles of each image in parallel, and the results are written as .npy files
+def run_tiled_batch(args):
+    name, params = args.operations[0]
+    if name == "window_filter":
+        size = params.pop("kernel_size", 3)
+        params["kernel"] = np.ones((size, size), dtype=np.float32) / (size * size)
+    processor = ImageProcessor()
+    root = batch_root(args.sources)
+    processed = failed = 0
+    for source in args.sources:
+        for path in iter_images(source):
+            output_path = output_file_for(path, root, args.output, '.npy')
+            try:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                processor.process_tiled(path, output_path, BATCH_OPERATIONS[name], args.tile_size, args.workers,
+                                        **params)
+                processed += 1
+            except (OSError, ValueError, cv2.error) as e:
+                print("{}: {}".format(path, e))
+                failed += 1
+    print("Processed {} images, {} failed.".format(processed, failed))
+    return 1 if failed or not processed else 0
+
+
+# Function to run the chain over all images with at most max_in_flight images submitted to the pool
+def run_batch(args):
+    os.makedirs(args.output, exist_ok=True)
+    if args.tile_size:
+        return run_tiled_batch(args)
+    workers = args.workers or os.cpu_count()
+    max_in_flight = args.max_in_flight or workers * 4
+    root = batch_root(args.sources)
+    processed = failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                             initargs=(args.operations, args.second, args.format,
+                                       args.quality, args.png_compression)) as executor:
+        pending = set()
+        for source in args.sources:
+            for path in iter_images(source):
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    processed, failed = report(done, processed, failed)
+                pending.add(executor.submit(process_batch_image, path,
+                                            output_file_for(path, root, args.output, args.format)))
+        processed, failed = report(wait(pending).done, processed, failed)
+    print("Processed {} images, {} failed.".format(processed, failed))
+    return 1 if failed or not processed else 0
+
+
+def report(done, processed, failed):
+    for future in done:
+        path, error = future.result()
+        if error:
+            print("{}: {}".format(path, error))
+            failed += 1
+        else:
+            processed += 1
+    return processed, failed
+
+
+# Function to parse an operation of the form "name" or "name:key=value,key=value"
+def parse_operation(text):
+    name, _, params_text = text.partition(":")
+    if name not in BATCH_OPERATIONS:
+        raise argparse.ArgumentTypeError("unknown operation {!r}, choose from: {}".format(
+            name, ", ".join(BATCH_OPERATIONS)))
+    params = {}
+    for item in filter(None, params_text.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            params[key.strip()] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            params[key.strip()] = value.strip()
+    check_params(name, params)
+    return name, params
+
+
+# Function to check the parameters of an operation before any image is submitted
+def check_params(name, params):
+    unknown = set(params) - set(OPERATION_PARAMS[name])
+    if unknown:
+        raise argparse.ArgumentTypeError("{}: unknown parameter(s) {}, expected: {}".format(
+            name, ", ".join(sorted(unknown)), ", ".join(OPERATION_PARAMS[name]) or "none"))
+    if name == "logical" and params.get("operation") not in ("AND", "OR", "XOR", "NOT"):
+        raise argparse.ArgumentTypeError("logical needs operation=AND, OR, XOR or NOT")
+    if name == "display_channel" and params.get("channel", "Red") not in ("Red", "Green", "Blue"):
+        raise argparse.ArgumentTypeError("display_channel: channel must be Red, Green or Blue")
+    if name in ("median_blur", "window_filter"):
+        size = params.get("kernel_size", 3)
+        if not isinstance(size, int) or size < 1 or (name == "median_blur" and size % 2 == 0):
+            raise argparse.ArgumentTypeError("{}: kernel_size must be a positive {}integer".format(
+                name, "odd " if name == "median_blur" else ""))
+    for key, value in params.items():
+        if key not in ("operation", "channel", "kernel_size") and not isinstance(value, (int, float)):
+            raise argparse.ArgumentTypeError("{}: {} must be a number".format(name, key))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Image processing. Without image sources the GUI is started.")
+    parser.add_argument("sources", nargs="*", help="directories or glob patterns of images")
+    parser.add_argument("-p", "--operation", dest="operations", action="append", type=parse_operation, default=[],
+                        help="operation to apply, repeat for a chain, e.g. -p sepia "
+                             "-p brightness_contrast:brightness=10,contrast=20 ({})".format(
+                                 ", ".join(BATCH_OPERATIONS)))
+    parser.add_argument("--second", default=None, help="second image for the logical and watercolor operations")
+    parser.add_argument("-o", "--output", default="processed", help="output directory")
+    parser.add_argument("-f", "--format", default=".jpg", help="output format (extension), e.g. .jpg, .png, .webp")
+    parser.add_argument("-q", "--quality", type=int, default=95, help="JPEG/WebP quality")
+    parser.add_argument("--png-compression", type=int, default=3, help="PNG compression level (0-9)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes (default: all cores)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of images submitted to the pool at once (default: 4 per process)")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="process every image tile by tile into a memory-mapped .npy file "
+                             "(one operation: {})".format(", ".join(TILED_OPERATIONS)))
+    args = parser.parse_args(argv)
+    if args.sources and not args.operations:
+        parser.error("at least one operation (-p) is required in batch mode")
+    if any(name in BINARY_OPERATIONS for name, _ in args.operations) and not args.second:
+        parser.error("the logical and watercolor operations need --second")
+    if args.tile_size and (len(args.operations) != 1 or args.operations[0][0] not in TILED_OPERATIONS):
+        parser.error("--tile-size works with one of the operations: " + ", ".join(TILED_OPERATIONS))
+    if not args.format.startswith("."):
+        args.format = "." + args.format
+    args.format = args.format.lower()
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.sources:
+        return run_batch(args)
     app = ImageProcessingApp()
     app.mainloop()
+
+if __name__ == "__main__":
+    sys.exit(main())
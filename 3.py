@@ -1,27 +1,43 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox
+import numpy as np
 from PIL import Image, ImageTk, ImageOps
+from transform_stack import TransformStack
 
 # Class for image processing
+# Transforms are added to a stack and composed into one matrix; the processed image is always
+# rendered from the original with a single resample
 class ImageProcessor:
     def __init__(self):
         self.original_image = None
         self.processed_image = None
+        self.transforms = None
     
     # Method to open an image file
     def open_image(self, filename):
         try:
             self.original_image = Image.open(filename)
             self.processed_image = self.original_image.copy()
+            self.transforms = TransformStack(self.original_image.size)
             return True
         except:
             messagebox.showerror("Error", "Failed to open image.")
             return False
         
-    # Method to apply scaling to the image
+    # Method to render all transforms of the stack from the original image
+    def render(self):
+        self.processed_image = self.transforms.render(self.original_image)
+
+    # Method to remove all transforms
+    def reset_transforms(self):
+        self.transforms.reset()
+        self.render()
+
+    # Method to apply scaling to the image (scale_x, scale_y - the new size in pixels)
     def apply_scaling(self, scale_x, scale_y):
         try:
-            self.processed_image = self.original_image.resize((int(scale_x), int(scale_y)), Image.BILINEAR)
+            self.transforms.resize(int(scale_x), int(scale_y))
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to apply scaling.")
@@ -30,10 +46,10 @@ class ImageProcessor:
     # Method to apply projection to the image
     def apply_projection(self, points):
         try:
-            # Projection of an image fragment onto an arbitrary plane
-            self.processed_image = self.original_image.transform(
-                (300, 300), Image.QUAD, points, resample=Image.BILINEAR
-            )
+            # Projection of an image fragment (four corners, as for Image.QUAD) onto an arbitrary plane
+            corners = [tuple(point) for point in np.asarray(points, dtype=np.float64).reshape(4, 2)]
+            self.transforms.quad(corners, (300, 300))
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to perform projection.")
@@ -42,9 +58,9 @@ class ImageProcessor:
     # Method to apply translation to the image    
     def apply_translation(self, translate_x, translate_y):
         try:
-            self.processed_image = self.original_image.transform(
-                self.original_image.size, Image.AFFINE, (1, 0, translate_x, 0, 1, translate_y)
-            )
+            # As Image.AFFINE (1, 0, translate_x, 0, 1, translate_y): the content moves by -translate
+            self.transforms.translate(-translate_x, -translate_y)
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to apply translation.")
@@ -53,10 +69,8 @@ class ImageProcessor:
     # Method to apply flipping to the image   
     def apply_flip(self, direction):
         try:
-            if direction == "horizontal":
-                self.processed_image = self.original_image.transpose(Image.FLIP_LEFT_RIGHT)
-            elif direction == "vertical":
-                self.processed_image = self.original_image.transpose(Image.FLIP_TOP_BOTTOM)
+            self.transforms.flip(direction)
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to apply flipping.")
@@ -65,7 +79,8 @@ class ImageProcessor:
     # Method to apply rotation to the image
     def apply_rotation(self, angle, center):
         try:
-            self.processed_image = self.original_image.rotate(angle, resample=Image.BILINEAR, center=center)
+            self.transforms.rotate(angle, center)
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to apply rotation.")
@@ -73,10 +88,10 @@ class ImageProcessor:
 
     def apply_projection(self, points):
         try:
-            # Projection of an image fragment onto an arbitrary plane
-            self.processed_image = self.original_image.transform(
-                (300, 300), Image.QUAD, points, resample=Image.BILINEAR
-            )
+            # Projection of an image fragment (four corners, as for Image.QUAD) onto an arbitrary plane
+            corners = [tuple(point) for point in np.asarray(points, dtype=np.float64).reshape(4, 2)]
+            self.transforms.quad(corners, (300, 300))
+            self.render()
             return True
         except:
             messagebox.showerror("Error", "Failed to perform projection.")
@@ -125,6 +140,9 @@ class App(tk.Tk):
         self.flip_vertical_button = tk.Button(self, text="Flip Vertically", command=lambda: self.flip_image("vertical"))
         self.flip_vertical_button.grid(row=8, columnspan=2, pady=5)
 
+        self.reset_button = tk.Button(self, text="Reset Transforms", command=self.reset_transforms)
+        self.reset_button.grid(row=9, columnspan=2, pady=5)
+
         self.left_panel.grid_propagate(False)
         self.right_panel.grid_propagate(False)
 
@@ -150,11 +168,19 @@ class App(tk.Tk):
         angle = self.angle_entry.get()
         if angle:
             angle = float(angle)
-            center = (self.image_processor.original_image.width // 2, self.image_processor.original_image.height // 2)
+            # Rotation around the center of the image after the previous transforms
+            width, height = self.image_processor.transforms.size
+            center = (width // 2, height // 2)
             success = self.image_processor.apply_rotation(angle, center)
             if success:
                 self.show_images()
 
+    # Method to remove all transforms and show the original image again
+    def reset_transforms(self):
+        if self.image_processor.transforms is not None:
+            self.image_processor.reset_transforms()
+            self.show_images()
+
     # Method to apply flipping to the image in the specified direction
     def flip_image(self, direction):
         success = self.image_processor.apply_flip(direction)
@@ -205,7 +231,9 @@ class App(tk.Tk):
         angle = self.angle_entry.get()
         if angle:
             angle = float(angle)
-            center = (self.image_processor.original_image.width // 2, self.image_processor.original_image.height // 2)
+            # Rotation around the center of the image after the previous transforms
+            width, height = self.image_processor.transforms.size
+            center = (width // 2, height // 2)
             success = self.image_processor.apply_rotation(angle, center)
             if success:
                 self.show_images()
@@ -2,7 +2,70 @@ import cv2
 import numpy as np
 import tkinter as tk
 from tkinter import filedialog
-from PIL import Image, ImageTk
+from blobs import filter_blobs
+from preview import PreviewSession
+from tiled_filters import kernel_halo, run_tiled
+from tk_display import ImageDisplay
+
+# Images with more pixels than this are preprocessed tile by tile in parallel
+TILED_MIN_PIXELS = 10000000
+BLUR_KERNEL_SIZE = (5, 5)
+
+
+# Function for the preprocessing: grayscale and Gaussian blur, back to 3 channels
+def blur_gray(image):
+    gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    blurred_image = cv2.GaussianBlur(gray_image, BLUR_KERNEL_SIZE, 0)
+    return cv2.cvtColor(blurred_image, cv2.COLOR_GRAY2BGR)
+
+
+# Operations of the preview chain (see preview.PreviewSession): function(image, scale, **params)
+def preprocess(image, scale=1.0):
+    height, width = image.shape[:2]
+    if height * width > TILED_MIN_PIXELS:
+        return run_tiled(blur_gray, image, np.empty_like(image), kernel_halo(BLUR_KERNEL_SIZE))
+    return blur_gray(image)
+
+
+# Function to find and draw primitives; returns (image with primitives, (triangles, quadrangles, circles))
+# min_area is given at full resolution and scaled to the image by scale ** 2
+def detect_primitives(image, scale=1.0, min_area=100):
+    image = image.copy()
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(gray, 50, 150, apertureSize=3)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area * scale * scale]
+
+    triangle_count = 0
+    rectangle_count = 0
+    circle_count = 0
+
+    for contour in filtered_contours:
+        perimeter = cv2.arcLength(contour, True)
+        approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
+        num_sides = len(approx)
+
+        if num_sides == 3:
+            shape = "triangle"
+            triangle_count += 1
+        elif num_sides == 4:
+            shape = "quadrangle"
+            rectangle_count += 1
+        else:
+            shape = "circle"
+            circle_count += 1
+
+        cv2.drawContours(image, [contour], 0, (0, 255, 0), 2)
+        cv2.putText(image, shape, (approx.ravel()[0], approx.ravel()[1]),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+    return image, (triangle_count, rectangle_count, circle_count)
+
+
+def draw_primitives(image, scale=1.0, min_area=100):
+    return detect_primitives(image, scale, min_area)[0]
+
 
 class ImageProcessingApp:
     def __init__(self, root):
@@ -11,6 +74,9 @@ class ImageProcessingApp:
 
         self.original_image = None
         self.processed_image = None
+        # Operations run on a downscaled proxy; the full image is rendered only by save_result
+        self.session = None
+        self.showing_contours = False
 
         self.create_widgets()
 
@@ -46,7 +112,8 @@ class ImageProcessingApp:
         # Поле для настройки порогового значения
         self.threshold_label = tk.Label(self.controls_frame, text="Level:")
         self.threshold_label.pack(padx=5, pady=5)
-        self.threshold_scale = tk.Scale(self.controls_frame, from_=0, to=255, orient=tk.HORIZONTAL)
+        self.threshold_scale = tk.Scale(self.controls_frame, from_=0, to=255, orient=tk.HORIZONTAL,
+                                        command=self.on_threshold_change)
         self.threshold_scale.set(127)
         self.threshold_scale.pack(fill=tk.X, padx=5, pady=5)
 
@@ -70,12 +137,18 @@ class ImageProcessingApp:
         self.processed_canvas = tk.Canvas(self.main_frame, width=400, height=400)
         self.processed_canvas.pack(side=tk.RIGHT, padx=10)
 
+        # One display (PhotoImage and canvas item) per canvas, updated in place
+        self.displays = {self.original_canvas: ImageDisplay(self.original_canvas),
+                         self.processed_canvas: ImageDisplay(self.processed_canvas)}
+
     def load_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.jpg;*.jpeg")])
         if file_path:
             self.original_image = cv2.imread(file_path)
-            self.processed_image = self.original_image.copy()
-            self.display_image(self.original_image, self.original_canvas)
+            self.session = PreviewSession(self.original_image)
+            self.processed_image = self.session.preview_image
+            self.showing_contours = False
+            self.display_image(self.session.proxy, self.original_canvas)
             self.display_image(self.processed_image, self.processed_canvas)
             self.preprocess_button.config(state=tk.NORMAL)
             self.contours_button.config(state=tk.NORMAL)
@@ -83,88 +156,73 @@ class ImageProcessingApp:
             self.save_button.config(state=tk.NORMAL)
 
     def display_image(self, image, canvas):
-        canvas.delete("all")
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image = Image.fromarray(image)
-        photo = ImageTk.PhotoImage(image)
-        canvas.photo = photo
-        canvas.create_image(0, 0, anchor=tk.NW, image=photo)
+        self.displays[canvas].show(image)
 
     def preprocess_image(self):
-        if self.original_image is not None:
-            gray_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-            blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-            self.processed_image = cv2.cvtColor(blurred_image, cv2.COLOR_GRAY2BGR)
+        if self.session is not None:
+            # Preprocessing starts again from the original image
+            self.session.reset()
+            self.processed_image = self.session.record(preprocess)
+            self.showing_contours = False
             self.display_image(self.processed_image, self.processed_canvas)
 
     def find_contours(self):
-        if self.processed_image is not None:
+        if self.session is not None:
             gray_image = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2GRAY)
             _, binary_image = cv2.threshold(gray_image, self.threshold_scale.get(), 255, cv2.THRESH_BINARY)
-            contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
+
             try:
                 min_area = int(self.min_area_entry.get())
             except ValueError:
                 min_area = 100
+            # The area is given at full resolution, the contours are searched on the proxy
+            min_area = max(1, int(min_area * self.session.scale ** 2))
 
-            filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
+            # Маленькие области отбрасываются по статистике компонент связности, без цикла по контурам
+            binary_image = filter_blobs(binary_image, min_area)
+            filtered_contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            image_with_contours = self.original_image.copy()
+            image_with_contours = self.session.proxy.copy()
             cv2.drawContours(image_with_contours, filtered_contours, -1, (0, 255, 0), 2)
             self.display_image(image_with_contours, self.processed_canvas)
+            self.showing_contours = True
 
-    def find_primitives(self):
-        if self.processed_image is not None:
-            gray = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Contours are searched on the proxy, so they can follow the slider
+    def on_threshold_change(self, value):
+        if self.showing_contours:
+            self.find_contours()
 
+    def find_primitives(self):
+        if self.session is not None:
             try:
                 min_area = int(self.min_area_entry.get())
             except ValueError:
                 min_area = 100
 
-            filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
-
-            triangle_count = 0
-            rectangle_count = 0
-            circle_count = 0
-
-            for contour in filtered_contours:
-                perimeter = cv2.arcLength(contour, True)
-                approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
-                num_sides = len(approx)
-
-                if num_sides == 3:
-                    shape = "triangle"
-                    triangle_count += 1
-                elif num_sides == 4:
-                    shape = "quadrangle"
-                    rectangle_count += 1
-                else:
-                    shape = "circle"
-                    circle_count += 1
-
-                cv2.drawContours(self.processed_image, [contour], 0, (0, 255, 0), 2)
-                cv2.putText(self.processed_image, shape, (approx.ravel()[0], approx.ravel()[1]), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+            # Primitives are drawn on the preview and recorded, so that save_result draws them at full size
+            image, (triangle_count, rectangle_count, circle_count) = detect_primitives(
+                self.processed_image, self.session.scale, min_area)
+            self.processed_image = self.session.record(draw_primitives, result=image, min_area=min_area)
+            self.showing_contours = False
 
             self.display_image(self.processed_image, self.processed_canvas)
             self.primitive_count_value.config(text=f"triangle: {triangle_count}, quadrangle: {rectangle_count}, circle: {circle_count}")
 
     def save_result(self):
-        if self.processed_image is not None:
+        if self.session is not None:
             file_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")])
             if file_path:
-                cv2.imwrite(file_path, cv2.cvtColor(self.processed_image, cv2.COLOR_RGB2BGR))
+                # The recorded operations are rendered again on the full-resolution image (already BGR)
+                cv2.imwrite(file_path, self.session.render_full())
 
     def load_image(self):
         file_path = filedialog.askopenfilename(filetypes=[("Image files", "*.png;*.jpg;*.jpeg")])
         if file_path:
             self.original_image = cv2.imread(file_path)
-            self.processed_image = self.original_image.copy()
-            self.display_image(self.original_image, self.original_canvas)
+            self.session = PreviewSession(self.original_image)
+            self.processed_image = self.session.preview_image
+            self.showing_contours = False
+            self.display_image(self.session.proxy, self.original_canvas)
             self.display_image(self.processed_image, self.processed_canvas)
             self.update_buttons_state()
 
@@ -176,64 +234,51 @@ class ImageProcessingApp:
         self.save_button.config(state=state)
 
     def preprocess_image(self):
-        if self.original_image is not None:
-            gray_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-            blurred_image = cv2.GaussianBlur(gray_image, (5, 5), 0)
-            self.processed_image = cv2.cvtColor(blurred_image, cv2.COLOR_GRAY2BGR)
+        if self.session is not None:
+            # Preprocessing starts again from the original image
+            self.session.reset()
+            self.processed_image = self.session.record(preprocess)
+            self.showing_contours = False
             self.display_image(self.processed_image, self.processed_canvas)
 
     def find_contours(self):
-        if self.processed_image is not None:
+        if self.session is not None:
             gray_image = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2GRAY)
             _, binary_image = cv2.threshold(gray_image, self.threshold_scale.get(), 255, cv2.THRESH_BINARY)
-            contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
+
             try:
                 min_area = int(self.min_area_entry.get())
             except ValueError:
                 min_area = 100
+            # The area is given at full resolution, the contours are searched on the proxy
+            min_area = max(1, int(min_area * self.session.scale ** 2))
 
-            filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
+            # Маленькие области отбрасываются по статистике компонент связности, без цикла по контурам
+            binary_image = filter_blobs(binary_image, min_area)
+            filtered_contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-            image_with_contours = self.original_image.copy()
+            image_with_contours = self.session.proxy.copy()
             cv2.drawContours(image_with_contours, filtered_contours, -1, (0, 255, 0), 2)
             self.display_image(image_with_contours, self.processed_canvas)
+            self.showing_contours = True
 
-    def find_primitives(self):
-        if self.processed_image is not None:
-            gray = cv2.cvtColor(self.processed_image, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-            contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # Contours are searched on the proxy, so they can follow the slider
+    def on_threshold_change(self, value):
+        if self.showing_contours:
+            self.find_contours()
 
+    def find_primitives(self):
+        if self.session is not None:
             try:
                 min_area = int(self.min_area_entry.get())
             except ValueError:
                 min_area = 100
 
-            filtered_contours = [cnt for cnt in contours if cv2.contourArea(cnt) >= min_area]
-
-            triangle_count = 0
-            rectangle_count = 0
-            circle_count = 0
-
-            for contour in filtered_contours:
-                perimeter = cv2.arcLength(contour, True)
-                approx = cv2.approxPolyDP(contour, 0.04 * perimeter, True)
-                num_sides = len(approx)
-
-                if num_sides == 3:
-                    shape = "triangle"
-                    triangle_count += 1
-                elif num_sides == 4:
-                    shape = "quadrangle"
-                    rectangle_count += 1
-                else:
-                    shape = "circle"
-                    circle_count += 1
-
-                cv2.drawContours(self.processed_image, [contour], 0, (0, 255, 0), 2)
-                cv2.putText(self.processed_image, shape, (approx.ravel()[0], approx.ravel()[1]), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+            # Primitives are drawn on the preview and recorded, so that save_result draws them at full size
+            image, (triangle_count, rectangle_count, circle_count) = detect_primitives(
+                self.processed_image, self.session.scale, min_area)
+            self.processed_image = self.session.record(draw_primitives, result=image, min_area=min_area)
+            self.showing_contours = False
 
             self.display_image(self.processed_image, self.processed_canvas)
             self.primitive_count_value.config(text=f"triangle: {triangle_count}, quadrangle: {rectangle_count}, circle: {circle_count}")
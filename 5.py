@@ -1,17 +1,107 @@
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import pytesseract
 pytesseract.pytesseract.tesseract_cmd = r'C:\Users\song_\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PIL import Image
+from face_detector import FaceDetector, FaceTracker
+from video_pipeline import VideoPipeline
 
+# Face detection runs on a copy of the frame downscaled by this factor
+FACE_DETECTION_SCALE = 0.5
+# In tracking mode the cascade runs every FACE_DETECT_EVERY frames, or earlier when
+# less than FACE_TRACK_MIN_CONFIDENCE of the tracked points inside a face survive
+FACE_DETECT_EVERY = 10
+FACE_TRACK_MIN_CONFIDENCE = 0.5
+MASK_PATH = "C:\\Users\song_\\Downloads\\mask.png"
+# Number of background OCR threads and the Hamming distance below which text regions count as unchanged
+OCR_WORKERS = 2
+OCR_HASH_DISTANCE = 10
 
 
+# Function to draw bounding boxes of text-like regions on the image
+def highlight_text_regions(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+
+# Function to compute a cheap perceptual hash (256 bits) of the thresholded text regions
+def text_region_hash(image, size=16):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    small = cv2.resize(thresh, (size, size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small > small.mean())
+
+
+# Class for OCR in a pool of background threads
+# Results are delivered to the GUI thread asynchronously through the text_recognized signal.
+class OcrWorkerPool(QtCore.QObject):
+    text_recognized = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, workers=OCR_WORKERS, hash_distance=OCR_HASH_DISTANCE):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.hash_distance = hash_distance
+        self.lock = threading.Lock()
+        self.last_hash = None
+        self.pending = 0
+        self.frame_index = 0
+
+    # Method to queue a frame for OCR; returns False if the frame was skipped
+    def submit(self, frame):
+        frame_hash = text_region_hash(frame)
+        with self.lock:
+            self.frame_index += 1
+            if self.last_hash is not None:
+                distance = np.unpackbits(frame_hash ^ self.last_hash).sum()
+                if distance <= self.hash_distance:
+                    return False
+            # All workers are busy: the frame is skipped instead of growing the backlog
+            if self.pending >= self.workers:
+                return False
+            self.last_hash = frame_hash
+            self.pending += 1
+            index = self.frame_index
+        pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        self.executor.submit(self.recognize, index, pil_image)
+        return True
+
+    def recognize(self, index, pil_image):
+        try:
+            text = pytesseract.image_to_string(pil_image)
+        except Exception as e:
+            text = "OCR error: " + str(e)
+        finally:
+            with self.lock:
+                self.pending -= 1
+        self.text_recognized.emit(index, text)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 class ImageProcessingApp(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
+        self.face_detector = FaceDetector(detection_scale=FACE_DETECTION_SCALE, min_size=(30, 30))
+        # The pipeline worker thread gets its own detector, the cascade is not shared between threads
+        self.video_face_detector = FaceDetector(detection_scale=FACE_DETECTION_SCALE, min_size=(30, 30))
+        self.face_tracker = FaceTracker(self.video_face_detector, detect_every=FACE_DETECT_EVERY,
+                                        min_confidence=FACE_TRACK_MIN_CONFIDENCE)
+        self.tracking_enabled = False
+        self.mask = None
+        self.pipeline = None
+        self.timer = None
+        self.ocr_pool = OcrWorkerPool()
         self.initUI()
+        self.ocr_pool.text_recognized.connect(self.display_text_message)
 
     def initUI(self):
         self.setWindowTitle("Image processing application")
@@ -19,6 +109,10 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
 
         self.left_label = QtWidgets.QLabel()
         self.right_label = QtWidgets.QLabel()
+        # Non-modal panel for text recognized on video
+        self.text_panel = QtWidgets.QPlainTextEdit()
+        self.text_panel.setReadOnly(True)
+        self.text_panel.setMaximumBlockCount(1000)
 
         self.load_image_button = QtWidgets.QPushButton("Laod img")
         self.detect_text_button = QtWidgets.QPushButton("Highlight text")
@@ -29,6 +123,8 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
         self.detect_faces_on_video_button = QtWidgets.QPushButton("Detect the faces in the video")
         self.apply_masks_on_faces_button = QtWidgets.QPushButton("Put masks on your faces")
         self.load_video_button = QtWidgets.QPushButton("Load video")
+        self.pipeline_checkbox = QtWidgets.QCheckBox("Pipeline mode")
+        self.tracking_checkbox = QtWidgets.QCheckBox("Track faces between detections")
 
         layout = QtWidgets.QHBoxLayout()
         left_layout = QtWidgets.QVBoxLayout()
@@ -42,10 +138,13 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
         left_layout.addWidget(self.detect_faces_on_video_button)
         left_layout.addWidget(self.apply_masks_on_faces_button)
         left_layout.addWidget(self.load_video_button)
+        left_layout.addWidget(self.pipeline_checkbox)
+        left_layout.addWidget(self.tracking_checkbox)
 
         right_layout.addWidget(self.right_label)
         right_layout.addWidget(self.detect_faces_button)
         right_layout.addWidget(self.apply_masks_button)
+        right_layout.addWidget(self.text_panel)
 
         layout.addLayout(left_layout)
         layout.addLayout(right_layout)
@@ -63,6 +162,7 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
         self.detect_faces_on_video_button.clicked.connect(self.detect_faces_on_video)
         self.apply_masks_on_faces_button.clicked.connect(self.apply_masks_on_faces)
         self.load_video_button.clicked.connect(self.load_video)
+        self.tracking_checkbox.toggled.connect(self.set_tracking_enabled)
 
     def load_image(self):
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select an image", "", "Image Files (*.png *.jpg *.jpeg *.bmp)")
@@ -73,16 +173,55 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
     def load_video(self):
         file_path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Select video", "", "Video Files (*.mp4 *.avi)")
         if file_path:
-            self.cap = cv2.VideoCapture(file_path)
+            self.stop_video()
             self.timer = QtCore.QTimer()
-            self.timer.timeout.connect(self.update_frame)
-            self.timer.start(30)
+            if self.pipeline_checkbox.isChecked():
+                self.pipeline = VideoPipeline(file_path)
+                if not self.pipeline.is_opened():
+                    self.pipeline = None
+                    QtWidgets.QMessageBox.warning(self, "ERROR", "Failed to open video.")
+                    return
+                self.face_tracker.request_reset()
+                self.pipeline.start()
+                self.timer.timeout.connect(self.update_pipeline_frame)
+                self.timer.start(10)
+            else:
+                self.cap = cv2.VideoCapture(file_path)
+                self.timer.timeout.connect(self.update_frame)
+                self.timer.start(30)
+
+    def stop_video(self):
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
 
     def update_frame(self):
         ret, frame = self.cap.read()
         if ret:
             self.show_image(self.left_label, frame)
 
+    # The Qt thread only paints the newest result of the pipeline
+    def update_pipeline_frame(self):
+        result = self.pipeline.latest()
+        if result is not None:
+            frame, processed = result
+            self.show_image(self.left_label, frame)
+            if processed is not None:
+                self.show_image(self.right_label, processed)
+        elif self.pipeline.finished:
+            error = self.pipeline.error
+            self.stop_video()
+            if error is not None:
+                QtWidgets.QMessageBox.warning(self, "ERROR", "Video processing failed: {}".format(error))
+
+    def closeEvent(self, event):
+        self.stop_video()
+        self.ocr_pool.shutdown()
+        super().closeEvent(event)
+
     def show_image(self, label, image):
         qt_img = QtGui.QImage(image.data, image.shape[1], image.shape[0], image.shape[1] * 3, QtGui.QImage.Format_RGB888)
         pixmap = QtGui.QPixmap.fromImage(qt_img)
@@ -91,12 +230,7 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
 
     def detect_and_display_text(self):
         if hasattr(self, 'image'):
-            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-            contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            for cnt in contours:
-                x, y, w, h = cv2.boundingRect(cnt)
-                cv2.rectangle(self.image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            highlight_text_regions(self.image)
             self.show_image(self.right_label, self.image)
         else:
             QtWidgets.QMessageBox.warning(self, "ERROR", "Upload image first.")
@@ -111,9 +245,7 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
 
     def detect_and_display_faces(self):
         if hasattr(self, 'image'):
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+            faces = self.face_detector.detect(self.image)
             for (x, y, w, h) in faces:
                 cv2.rectangle(self.image, (x, y), (x + w, y + h), (0, 255, 0), 2)
             self.show_image(self.right_label, self.image)
@@ -121,73 +253,101 @@ class ImageProcessingApp(QtWidgets.QMainWindow):
             QtWidgets.QMessageBox.warning(self, "ERROR", "Upload image first.")
 
     def apply_face_masks(self):
+        if not self.load_mask():
+            return
         if hasattr(self, 'image'):
-            mask_path = "C:\\Users\song_\\Downloads\\mask.png"
-            mask = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-            for (x, y, w, h) in faces:
-                mask_resized = cv2.resize(mask, (w, h))
-                mask_resized = cv2.cvtColor(mask_resized, cv2.COLOR_BGR2BGRA)
-                roi = self.image[y:y+h, x:x+ w]
-                roi_bg = cv2.bitwise_and(roi, roi, mask=cv2.bitwise_not(mask_resized[:, :, 3]))
-                roi_fg = cv2.bitwise_and(mask_resized[:, :, :3], mask_resized[:, :, :3])
-                self.image[y:y+h, x:x+w] = cv2.addWeighted(roi_bg, 1.0, roi_fg, 0.4, 0)
+            faces = self.face_detector.detect(self.image)
+            self.put_masks(self.image, faces)
             self.show_image(self.right_label, self.image)
         else:
             QtWidgets.QMessageBox.warning(self, "ERROR", "Upload image first.")
 
+    # Method to read the mask file once; shows an error and returns False if it can not be read
+    def load_mask(self):
+        if self.mask is None:
+            self.mask = cv2.imread(MASK_PATH, cv2.IMREAD_UNCHANGED)
+        if self.mask is None:
+            QtWidgets.QMessageBox.warning(self, "ERROR", "Failed to read mask: " + MASK_PATH)
+            return False
+        return True
+
+    # Method to draw the mask over every detected face (load_mask must have succeeded)
+    def put_masks(self, image, faces):
+        if self.mask is None:
+            raise IOError("Failed to read mask: " + MASK_PATH)
+        for (x, y, w, h) in faces:
+            mask_resized = cv2.resize(self.mask, (w, h))
+            mask_resized = cv2.cvtColor(mask_resized, cv2.COLOR_BGR2BGRA)
+            roi = image[y:y+h, x:x+w]
+            roi_bg = cv2.bitwise_and(roi, roi, mask=cv2.bitwise_not(mask_resized[:, :, 3]))
+            roi_fg = cv2.bitwise_and(mask_resized[:, :, :3], mask_resized[:, :, :3])
+            image[y:y+h, x:x+w] = cv2.addWeighted(roi_bg, 1.0, roi_fg, 0.4, 0)
+
+    def set_tracking_enabled(self, enabled):
+        self.face_tracker.request_reset()
+        self.tracking_enabled = enabled
+
+    # Method to find faces on consecutive pipeline frames, with tracking between detections if enabled
+    def detect_video_faces(self, frame):
+        if self.tracking_enabled:
+            return self.face_tracker.update(frame)
+        return self.video_face_detector.detect(frame)
+
+    # Analyzers for the pipeline worker thread
+    def draw_faces_on_frame(self, frame):
+        faces = self.detect_video_faces(frame)
+        for (x, y, w, h) in faces:
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+    def put_masks_on_frame(self, frame):
+        self.put_masks(frame, self.detect_video_faces(frame))
+
     def apply_masks_on_faces(self):
-        if hasattr(self, 'cap'):
+        if not self.load_mask():
+            return
+        if self.pipeline is not None:
+            self.pipeline.analyzer = self.put_masks_on_frame
+        elif hasattr(self, 'cap'):
             ret, frame = self.cap.read()
             if ret:
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-                for (x, y, w, h) in faces:
-                    mask_path = "C:\\Users\song_\\Downloads\\mask.png"
-                    mask = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
-                    mask_resized = cv2.resize(mask, (w, h))
-                    mask_resized = cv2.cvtColor(mask_resized, cv2.COLOR_BGR2BGRA)
-                    roi = frame[y:y+h, x:x+w]
-                    roi_bg = cv2.bitwise_and(roi, roi, mask=cv2.bitwise_not(mask_resized[:, :, 3]))
-                    roi_fg = cv2.bitwise_and(mask_resized[:, :, :3], mask_resized[:, :, :3])
-                    frame[y:y+h, x:x+w] = cv2.addWeighted(roi_bg, 1.0, roi_fg, 0.4, 0)
+                faces = self.face_detector.detect(frame)
+                self.put_masks(frame, faces)
                 self.show_image(self.right_label, frame)
         else:
             QtWidgets.QMessageBox.warning(self, "ERROR", "Upload video first.")
 
     def detect_text_on_video(self):
-        if hasattr(self, 'cap'):
+        if self.pipeline is not None:
+            self.pipeline.analyzer = self.recognize_text_on_frame
+        elif hasattr(self, 'cap'):
             ret, frame = self.cap.read()
             if ret:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-                contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-                for cnt in contours:
-                    x, y, w, h = cv2.boundingRect(cnt)
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                self.recognize_text_on_frame(frame)
                 self.show_image(self.right_label, frame)
-                self.recognize_text(frame)
         else:
             QtWidgets.QMessageBox.warning(self, "ERROR", "Upload video first.")
 
+    # The frame is sent to OCR before the boxes are drawn on it
+    def recognize_text_on_frame(self, frame):
+        self.recognize_text(frame)
+        highlight_text_regions(frame)
+
+    # Method to send the frame to the OCR pool; the text arrives later in display_text_message
     def recognize_text(self, frame):
-        pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        text = pytesseract.image_to_string(pil_image)
-        self.display_text_message(text)
+        self.ocr_pool.submit(frame)
 
-    def display_text_message(self, text):
-        QtWidgets.QMessageBox.information(self, "Recognized text", text)
+    def display_text_message(self, index, text):
+        text = text.strip()
+        if text:
+            self.text_panel.appendPlainText("[frame {}]\n{}".format(index, text))
 
     def detect_faces_on_video(self):
-        if hasattr(self, 'cap'):
+        if self.pipeline is not None:
+            self.pipeline.analyzer = self.draw_faces_on_frame
+        elif hasattr(self, 'cap'):
             ret, frame = self.cap.read()
             if ret:
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+                faces = self.face_detector.detect(frame)
                 for (x, y, w, h) in faces:
                     cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
                 self.show_image(self.right_label, frame)
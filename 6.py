@@ -1,24 +1,164 @@
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+import time
 import cv2
+import numpy as np
 import tkinter as tk
 from tkinter import filedialog
-from PIL import Image, ImageTk
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from blobs import extract_blobs
+from frame_source import ThreadedFrameSource
+from preview import fit_scale, make_proxy
+from tk_display import ImageDisplay
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.mpg', '.mpeg')
+MIN_MOTION_AREA = 700
+
+
+# Function to create the background subtractor with the settings used by the application
+def create_background_subtractor(history=1000, var_threshold=32):
+    return cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=var_threshold, detectShadows=True)
+
+
+# Function to find moving objects on a frame
+# Returns the foreground mask and an int32 array of rows (x, y, w, h, area) for every object
+# with at least min_area pixels. kernel_size > 0 enables morphological cleanup of the mask.
+def find_motion(background_subtractor, frame, min_area=MIN_MOTION_AREA, learning_rate=-1, roi=None, kernel_size=0):
+    gray_frame = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    fg_mask = background_subtractor.apply(gray_frame, learningRate=learning_rate)
+    fg_mask = cv2.threshold(fg_mask, 240, 255, cv2.THRESH_BINARY)[1]
+    if roi is not None:
+        fg_mask = cv2.bitwise_and(fg_mask, roi)
+    objects = extract_blobs(fg_mask, min_area, kernel_size=kernel_size)
+    return fg_mask, objects
+
+
+# Class for motion detection on a downscaled frame and, optionally, only inside a region of interest
+# The ROI mask is an image where non-zero pixels mark the zones to analyze.
+class MotionDetector:
+    def __init__(self, history=1000, var_threshold=32, min_area=MIN_MOTION_AREA, scale=1.0, roi_path=None,
+                 kernel_size=0):
+        if not 0 < scale <= 1:
+            raise ValueError("scale must be in (0, 1]")
+        self.background_subtractor = create_background_subtractor(history, var_threshold)
+        self.min_area = min_area
+        self.scale = scale
+        self.kernel_size = kernel_size
+        self.roi_source = None
+        if roi_path:
+            self.roi_source = cv2.imread(roi_path, cv2.IMREAD_GRAYSCALE)
+            if self.roi_source is None:
+                raise IOError("Failed to load ROI mask: " + roi_path)
+        self.roi = None
+        self.roi_rect = None
+        self.frame_size = None
+
+    # Method to fit the ROI mask to the processing resolution; done once per frame size
+    def prepare_roi(self, size):
+        self.frame_size = size
+        width, height = size
+        if self.roi_source is None:
+            self.roi = None
+            self.roi_rect = (0, 0, width, height)
+            return
+        roi = cv2.resize(self.roi_source, (width, height), interpolation=cv2.INTER_NEAREST)
+        roi = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY)[1]
+        x, y, w, h = cv2.boundingRect(roi)
+        if w == 0 or h == 0:
+            x, y, w, h = 0, 0, width, height
+        # Background subtraction only runs on the bounding box of the ROI
+        self.roi_rect = (x, y, w, h)
+        self.roi = roi[y:y + h, x:x + w]
+
+    # Method to detect motion; boxes and areas are returned in full-resolution coordinates,
+    # the mask at the processing resolution
+    def detect(self, frame, learning_rate=-1):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        size = (gray.shape[1], gray.shape[0])
+        if size != self.frame_size:
+            self.prepare_roi(size)
+        x0, y0, w, h = self.roi_rect
+        crop = gray[y0:y0 + h, x0:x0 + w]
+        area_scale = self.scale * self.scale
+        fg_crop, objects = find_motion(self.background_subtractor, crop, self.min_area * area_scale, learning_rate,
+                                       self.roi, self.kernel_size)
+        if fg_crop.shape == gray.shape:
+            fg_mask = fg_crop
+        else:
+            fg_mask = np.zeros_like(gray)
+            fg_mask[y0:y0 + h, x0:x0 + w] = fg_crop
+        if self.scale != 1.0 or x0 or y0:
+            objects = objects.astype(np.float64)
+            objects[:, :2] += (x0, y0)
+            objects[:, :4] /= self.scale
+            objects[:, 4] /= area_scale
+            objects = np.round(objects).astype(np.int32)
+        return fg_mask, objects
+
+
+# Class for adaptive frame skipping: while analysis of a frame takes longer than the time budget,
+# the following frames are not analyzed
+class FrameSkipGovernor:
+    def __init__(self, budget_ms, max_skip=10, smoothing=0.8):
+        self.budget = budget_ms / 1000.0
+        self.max_skip = max_skip
+        self.smoothing = smoothing
+        self.average = None
+        self.skip = 0
+        self.skipped = 0
+        self.counter = 0
+
+    # Method to decide whether the next frame should be analyzed
+    def should_process(self):
+        if self.counter >= self.skip:
+            self.counter = 0
+            return True
+        self.counter += 1
+        self.skipped += 1
+        return False
+
+    # Method to record the processing time of an analyzed frame (in seconds)
+    def record(self, elapsed):
+        if self.average is None:
+            self.average = elapsed
+        else:
+            self.average = self.smoothing * self.average + (1 - self.smoothing) * elapsed
+        # With k skipped frames the cost per source frame is average / (k + 1)
+        needed = math.ceil(self.average / self.budget) - 1 if self.budget > 0 else 0
+        self.skip = min(self.max_skip, max(0, needed))
+
 
 class MotionDetectionApp:
-    def __init__(self, master):
+    def __init__(self, master, scale=1.0, roi_path=None, budget_ms=None, kernel_size=0):
         self.master = master
         self.master.title("Motion Detection Application")
         
         self.video_source = None
         self.capture = None
         self.frame = None
-        self.background_subtractor = cv2.createBackgroundSubtractorMOG2(history=1000, varThreshold=32, detectShadows=True)
+        self.scale = scale
+        self.roi_path = roi_path
+        self.budget_ms = budget_ms
+        self.detector = MotionDetector(scale=scale, roi_path=roi_path, kernel_size=kernel_size)
+        self.governor = FrameSkipGovernor(budget_ms) if budget_ms else None
+        self.fg_mask = None
+        self.objects = np.empty((0, 5), dtype=np.int32)
         
         self.original_label = tk.Label(master)
         self.original_label.grid(row=0, column=0)
         
         self.processed_label = tk.Label(master)
         self.processed_label.grid(row=0, column=1)
+        # One PhotoImage per label, updated in place on every frame
+        self.original_display = ImageDisplay(self.original_label)
+        self.processed_display = ImageDisplay(self.processed_label)
         
         self.webcam_button = tk.Button(master, text="Webcam", command=self.start_webcam_motion_detection)
         self.webcam_button.grid(row=1, column=0)
@@ -30,9 +170,12 @@ class MotionDetectionApp:
         self.stop_button.grid(row=2, column=0, columnspan=2, pady=5)
         self.stop_button.config(state="disabled")
         
+        self.stats_label = tk.Label(master, text="")
+        self.stats_label.grid(row=3, column=0, columnspan=2)
+        
     def start_webcam_motion_detection(self):
         self.video_source = 0 # 0 for webcam
-        self.capture = cv2.VideoCapture(self.video_source)
+        self.capture = ThreadedFrameSource(self.video_source).start()
         self.stop_button.config(state="normal")
         self.webcam_button.config(state="disabled")
         self.video_button.config(state="disabled")
@@ -40,7 +183,9 @@ class MotionDetectionApp:
         
     def start_video_motion_detection(self):
         self.video_source = filedialog.askopenfilename() # Select video file
-        self.capture = cv2.VideoCapture(self.video_source)
+        if not self.video_source:
+            return
+        self.capture = ThreadedFrameSource(self.video_source).start()
         self.stop_button.config(state="normal")
         self.webcam_button.config(state="disabled")
         self.video_button.config(state="disabled")
@@ -49,43 +194,180 @@ class MotionDetectionApp:
     def stop_motion_detection(self):
         if self.capture is not None:
             self.capture.release()
+            self.capture = None
             self.stop_button.config(state="disabled")
             self.webcam_button.config(state="normal")
             self.video_button.config(state="normal")
         
+    # Frames are decoded by the capture thread; the UI loop only takes the newest one
     def motion_detection(self):
-        ret, frame = self.capture.read()
-        if ret:
-            gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            fg_mask = self.background_subtractor.apply(gray_frame)
-            fg_mask = cv2.threshold(fg_mask, 240, 255, cv2.THRESH_BINARY)[1]
-            
-            contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            for contour in contours:
-                if cv2.contourArea(contour) > 700:
-                    x, y, w, h = cv2.boundingRect(contour)
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            
-            original_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            processed_image = Image.fromarray(fg_mask)
-            
-            original_image = ImageTk.PhotoImage(image=Image.fromarray(original_image))
-            processed_image = ImageTk.PhotoImage(image=processed_image)
-            
-            self.original_label.config(image=original_image)
-            self.original_label.image = original_image
-            
-            self.processed_label.config(image=processed_image)
-            self.processed_label.image = processed_image
-            
-            self.master.after(10, self.motion_detection)
-        else:
+        if self.capture is None:
+            return
+        if self.capture.is_finished():
             self.stop_motion_detection()
+            return
+        frame = self.capture.read()
+        if frame is not None:
+            if self.governor is None or self.governor.should_process():
+                start = time.perf_counter()
+                self.fg_mask, self.objects = self.detector.detect(frame)
+                if self.governor is not None:
+                    self.governor.record(time.perf_counter() - start)
+            # Detection runs on the full frame, but the frame and the mask are shown downscaled to the display,
+            # so the boxes are drawn on the small copy
+            display_scale = fit_scale(frame.shape)
+            frame = make_proxy(frame)
+            # On skipped frames the boxes from the last analyzed frame are shown
+            for (x, y, w, h) in np.round(self.objects[:, :4] * display_scale).astype(int):
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+            
+            self.original_display.show(frame)
+            self.processed_display.show(make_proxy(self.fg_mask, interpolation=cv2.INTER_NEAREST))
+            self.stats_label.config(text=self.capture.stats_text())
+        self.master.after(10, self.motion_detection)
+
+# Headless batch mode
+# Every process of the pool keeps its own motion detector (and background subtractor)
+worker_detector = None
+worker_budget_ms = None
+
+
+def init_batch_worker(history, var_threshold, min_area, scale, roi_path, budget_ms, kernel_size):
+    global worker_detector, worker_budget_ms
+    worker_detector = MotionDetector(history, var_threshold, min_area, scale, roi_path, kernel_size)
+    worker_budget_ms = budget_ms
+
+
+# Function to write motion events of one video file as JSON Lines into output_file
+# Returns (video_path, frames, events, error)
+def detect_motion_in_file(video_path, output_file):
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        return video_path, 0, 0, "failed to open"
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_index = 0
+    event_count = 0
+    # An error in one file (output not writable, bad ROI) is reported for that file and the batch goes on
+    try:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        governor = FrameSkipGovernor(worker_budget_ms) if worker_budget_ms else None
+        with open(output_file, 'w', encoding='utf-8') as f:
+            while True:
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                # learningRate=1 on the first frame reinitializes the model left from the previous file,
+                # so the first frame only builds the background and is not reported
+                learning_rate = 1 if frame_index == 0 else -1
+                if frame_index > 0 and governor is not None and not governor.should_process():
+                    frame_index += 1
+                    continue
+                start = time.perf_counter()
+                _, objects = worker_detector.detect(frame, learning_rate)
+                if governor is not None:
+                    governor.record(time.perf_counter() - start)
+                if len(objects) and frame_index > 0:
+                    event = {
+                        "frame": frame_index,
+                        "timestamp": round(frame_index / fps, 3),
+                        "boxes": [[int(x), int(y), int(w), int(h)] for (x, y, w, h, _) in objects],
+                        "areas": [int(area) for (_, _, _, _, area) in objects],
+                    }
+                    f.write(json.dumps(event) + "\n")
+                    event_count += 1
+                frame_index += 1
+    except (OSError, ValueError, cv2.error) as e:
+        return video_path, frame_index, event_count, str(e)
+    finally:
+        capture.release()
+    return video_path, frame_index, event_count, None
+
+
+# Function to get the list of video files from a directory or a glob pattern
+def collect_videos(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(VIDEO_EXTENSIONS))
+
+
+# Function to get the directory the output tree mirrors: the common directory of all sources
+# (for a glob pattern - the part before the first wildcard)
+def batch_root(sources):
+    roots = []
+    for source in sources:
+        root = source if os.path.isdir(source) else os.path.dirname(source)
+        while glob.has_magic(root):
+            root = os.path.dirname(root)
+        roots.append(os.path.abspath(root or os.curdir))
+    return os.path.commonpath(roots)
+
+
+# Function to get the .jsonl file of a video: its path relative to root with .jsonl added,
+# e.g. root/cam1/clip.mp4 -> output/cam1/clip.mp4.jsonl, so videos with the same name
+# (in different directories or with different extensions) do not overwrite each other
+def output_file_for(video_path, root, output_dir):
+    return os.path.join(output_dir, os.path.relpath(os.path.abspath(video_path), root) + '.jsonl')
+
+
+def run_batch(args):
+    videos = []
+    for source in args.sources:
+        videos.extend(collect_videos(source))
+    # A video matched by several sources is processed once
+    videos = list(dict.fromkeys(os.path.abspath(path) for path in videos))
+    if not videos:
+        print("No video files found.")
+        return 1
+    # The ROI is loaded by every worker at start; a missing file would break the whole pool
+    if args.roi and cv2.imread(args.roi, cv2.IMREAD_GRAYSCALE) is None:
+        print("Failed to load ROI mask: " + args.roi)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+    root = batch_root(args.sources)
+    print("Processing {} files with {} workers...".format(len(videos), args.workers or os.cpu_count()))
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_batch_worker,
+                             initargs=(args.history, args.var_threshold, args.min_area,
+                                       args.scale, args.roi, args.budget_ms, args.morph_kernel)) as executor:
+        futures = [executor.submit(detect_motion_in_file, path, output_file_for(path, root, args.output))
+                   for path in videos]
+        failed = 0
+        for future in as_completed(futures):
+            path, frames, events, error = future.result()
+            if error:
+                print("{}: {}".format(path, error))
+                failed += 1
+            else:
+                print("{}: {} frames, {} frames with motion".format(path, frames, events))
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Motion detection. Without video sources the GUI is started.")
+    parser.add_argument("sources", nargs="*", help="directories or glob patterns of video files")
+    parser.add_argument("-o", "--output", default="motion_events", help="directory for the .jsonl files")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes (default: all cores)")
+    parser.add_argument("--min-area", type=float, default=MIN_MOTION_AREA, help="minimum object area in pixels")
+    parser.add_argument("--history", type=int, default=1000, help="MOG2 history length")
+    parser.add_argument("--var-threshold", type=float, default=32, help="MOG2 variance threshold")
+    parser.add_argument("--scale", type=float, default=1.0, help="downscale factor for background subtraction, e.g. 0.25")
+    parser.add_argument("--roi", default=None, help="mask image, non-zero pixels mark the zones to analyze")
+    parser.add_argument("--morph-kernel", type=int, default=0,
+                        help="size of the morphological cleanup kernel for the motion mask (0 - off)")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="time budget per frame; frames are skipped while analysis is slower")
+    return parser.parse_args(argv)
+
 
 def main():
+    args = parse_args()
+    if args.sources:
+        return run_batch(args)
     root = tk.Tk()
-    app = MotionDetectionApp(root)
+    app = MotionDetectionApp(root, scale=args.scale, roi_path=args.roi, budget_ms=args.budget_ms,
+                             kernel_size=args.morph_kernel)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
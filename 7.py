@@ -1,8 +1,21 @@
+import os
 import cv2
 import tkinter as tk
 from tkinter import filedialog
-from PIL import Image, ImageTk
 import numpy as np
+from feature_cache import OrbFeatureCache
+from gallery_index import OrbGalleryIndex
+from feature_tracker import StreamingFeatureTracker
+from tiled_features import extract_corners_tiled
+from frame_source import ThreadedFrameSource
+from tk_display import ImageDisplay
+
+# Directory for ORB features kept between runs; None - cache only in memory
+ORB_CACHE_DIR = None
+# Images with at least this many pixels are processed tile by tile on all cores
+TILED_MIN_PIXELS = 10000000
+# Number of gallery images returned for a query
+GALLERY_TOP_K = 5
 
 class FeatureDetectionApp:
     def __init__(self, master):
@@ -12,6 +25,11 @@ class FeatureDetectionApp:
         self.video_source = 0  # Default - webcam
         self.capture = None
         self.frame = None
+        # Keypoints and descriptors are extracted once per image
+        self.orb_cache = OrbFeatureCache(cache_dir=ORB_CACHE_DIR, tiled_min_pixels=TILED_MIN_PIXELS)
+        self.keypoints = None
+        self.gallery = None
+        self.tracker = StreamingFeatureTracker()
         
         # Creating widgets
         self.original_label = tk.Label(master)
@@ -19,6 +37,9 @@ class FeatureDetectionApp:
         
         self.processed_label = tk.Label(master)
         self.processed_label.grid(row=0, column=1)
+        # One display (PhotoImage) per label, updated in place
+        self.displays = {self.original_label: ImageDisplay(self.original_label),
+                         self.processed_label: ImageDisplay(self.processed_label)}
         
         self.load_button = tk.Button(master, text="Load Image", command=self.load_image)
         self.load_button.grid(row=1, column=0, columnspan=2, pady=10)
@@ -32,6 +53,18 @@ class FeatureDetectionApp:
         self.match_features_button = tk.Button(master, text="Match Features", command=self.match_features)
         self.match_features_button.grid(row=4, column=0, columnspan=2, pady=5)
         
+        self.index_gallery_button = tk.Button(master, text="Index Gallery", command=self.index_gallery)
+        self.index_gallery_button.grid(row=5, column=0, pady=5)
+        
+        self.search_gallery_button = tk.Button(master, text="Search Gallery", command=self.search_gallery)
+        self.search_gallery_button.grid(row=5, column=1, pady=5)
+        
+        self.gallery_label = tk.Label(master, text="", justify=tk.LEFT)
+        self.gallery_label.grid(row=6, column=0, columnspan=2, pady=5)
+        
+        self.track_video_button = tk.Button(master, text="Track Video", command=self.toggle_video_tracking)
+        self.track_video_button.grid(row=7, column=0, columnspan=2, pady=5)
+        
     # Method to load an image
     def load_image(self):
         self.file_path = filedialog.askopenfilename()
@@ -41,20 +74,22 @@ class FeatureDetectionApp:
         
     # Method to display an image in a widget
     def display_image(self, image, label):
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        image_pil = Image.fromarray(image_rgb)
-        image_tk = ImageTk.PhotoImage(image_pil)
-        label.config(image=image_tk)
-        label.image = image_tk
+        self.displays[label].show(image)
     
     # Method to find features
     def find_features(self):
         if self.original_image is None:
             return
         gray = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-        self.keypoints = cv2.goodFeaturesToTrack(gray, maxCorners=100, qualityLevel=0.01, minDistance=10)
-        self.keypoints = [cv2.KeyPoint(x[0][0], x[0][1], 1) for x in self.keypoints]
-        self.keypoints_image = cv2.drawKeypoints(self.original_image, self.keypoints, None, color=(0, 255, 0))
+        # Keypoints are kept as an Nx2 float32 array of coordinates
+        if gray.size >= TILED_MIN_PIXELS:
+            # Large images: parallel grid of tiles, each with its own share of the corner budget
+            self.keypoints, _ = extract_corners_tiled(gray, max_corners=100, quality_level=0.01, min_distance=10)
+        else:
+            corners = cv2.goodFeaturesToTrack(gray, maxCorners=100, qualityLevel=0.01, minDistance=10)
+            self.keypoints = np.empty((0, 2), dtype=np.float32) if corners is None else corners.reshape(-1, 2)
+        self.keypoints_image = cv2.drawKeypoints(self.original_image, cv2.KeyPoint_convert(self.keypoints), None,
+                                                 color=(0, 255, 0))
         self.display_image(self.keypoints_image, self.processed_label)
         
     # Method to track features
@@ -69,7 +104,7 @@ class FeatureDetectionApp:
         if new_image_path:
             new_image = cv2.imread(new_image_path)
             new_gray = cv2.cvtColor(new_image, cv2.COLOR_BGR2GRAY)
-            p0 = np.array([point.pt for point in self.keypoints], dtype=np.float32)
+            p0 = self.keypoints.reshape(-1, 1, 2)
             p1, st, err = cv2.calcOpticalFlowPyrLK(old_gray, new_gray, p0, None)
 
             # Add debug output to check the dimensionality of st
@@ -87,6 +122,41 @@ class FeatureDetectionApp:
             
             self.display_image(new_image, self.processed_label)
     
+    # Method to start or stop feature tracking on a video file (or the webcam if no file is selected)
+    def toggle_video_tracking(self):
+        if self.capture is not None:
+            self.stop_video_tracking()
+            return
+        path = filedialog.askopenfilename(filetypes=[("Video Files", "*.mp4;*.avi;*.mov;*.mkv")])
+        self.video_source = path if path else 0
+        self.capture = ThreadedFrameSource(self.video_source).start()
+        self.tracker.reset()
+        self.track_video_button.config(text="Stop Tracking")
+        self.track_video()
+    
+    def stop_video_tracking(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+        self.track_video_button.config(text="Track Video")
+    
+    # Method to track features on the next video frame
+    def track_video(self):
+        if self.capture is None:
+            return
+        if self.capture.is_finished():
+            self.stop_video_tracking()
+            return
+        frame = self.capture.read()
+        if frame is not None:
+            self.display_image(frame, self.original_label)
+            good_new, good_old = self.tracker.update(frame)
+            for (a, b), (c, d) in zip(good_new, good_old):
+                cv2.circle(frame, (int(a), int(b)), 3, (0, 255, 0), -1)
+                cv2.line(frame, (int(a), int(b)), (int(c), int(d)), (0, 255, 0), 2)
+            self.display_image(frame, self.processed_label)
+        self.master.after(10, self.track_video)
+    
     # Method to match features
     def match_features(self):
         if self.original_image is None:
@@ -94,17 +164,36 @@ class FeatureDetectionApp:
         new_image_path = filedialog.askopenfilename()
         if new_image_path:
             new_image = cv2.imread(new_image_path)
-            gray1 = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(new_image, cv2.COLOR_BGR2GRAY)
-            orb = cv2.ORB_create()
-            kp1, des1 = orb.detectAndCompute(gray1, None)
-            kp2, des2 = orb.detectAndCompute(gray2, None)
+            kp1, des1 = self.orb_cache.compute(self.original_image)
+            kp2, des2 = self.orb_cache.compute(new_image)
             bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
             matches = bf.match(des1, des2)
             matches = sorted(matches, key = lambda x:x.distance)
             matching_result = cv2.drawMatches(self.original_image, kp1, new_image, kp2, matches[:10], None, flags=cv2.DrawMatchesFlags_NOT_DRAW_SINGLE_POINTS)
             self.display_image(matching_result, self.processed_label)
 
+    # Method to index ORB features of every image in a directory
+    def index_gallery(self):
+        directory = filedialog.askdirectory()
+        if directory:
+            self.gallery = OrbGalleryIndex(self.orb_cache)
+            count = self.gallery.add_directory(directory)
+            self.gallery.train()
+            self.gallery_label.config(text="Indexed images: {}".format(count))
+    
+    # Method to find the gallery images most similar to the loaded image
+    def search_gallery(self):
+        if self.original_image is None or self.gallery is None:
+            return
+        results = self.gallery.search(self.original_image, top_k=GALLERY_TOP_K, verify=True)
+        if not results:
+            self.gallery_label.config(text="No matches found")
+            return
+        lines = ["{}. {} - matches: {}, inliers: {}".format(i + 1, os.path.basename(path), matches, inliers)
+                 for i, (path, matches, inliers) in enumerate(results)]
+        self.gallery_label.config(text="\n".join(lines))
+        self.display_image(cv2.imread(results[0][0]), self.processed_label)
+
 def main():
     root = tk.Tk()
     app = FeatureDetectionApp(root)
@@ -1,75 +1,152 @@
 import cv2
 import os
 import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+from concurrent.futures import ProcessPoolExecutor
+from face_detector import FaceDetector
+from face_dataset import CACHE_DIR_NAME, load_dataset
+from face_model import load_or_train_recognizer
+from face_shards import ShardedLbpGallery
+from lbp import LbpGallery
+
+# Path to the Haar cascade file for face detection
+cascadePath = r"C:\Users\song_\Downloads\haarcascade_frontalface_default.xml"
+
+# Path to the directory with training images
+input_path = r'C:\Users\song_\Downloads\faces'
+
+# Path to the directory where processed images will be saved
+output_path = r'C:\Users\song_\Downloads\КЗ 211-172 Газизова Алина Андреевна лабы\8'
+
+# Path to the saved LBPH model (stored together with the fingerprint of the training set)
+MODEL_PATH = os.path.join(input_path, CACHE_DIR_NAME, 'lbph_model.yml')
+
+# Size (width, height) to which faces are normalized for training; None keeps the original sizes
+FACE_SIZE = None
+
+# Directory with the faces to recognize (None - recognition is skipped) and the size to which
+# gallery and probe faces are aligned for the batched LBP matching
+PROBE_PATH = None
+RECOGNITION_FACE_SIZE = (100, 100)
+
+# Number of gallery shards, each held by its own process (1 - the gallery stays in this process,
+# None - one shard per core)
+GALLERY_SHARDS = None
+
+# JPEG quality of the processed images and the number of output processes (None - all cores)
+JPEG_QUALITY = 95
+OUTPUT_WORKERS = None
+# Face detection in the output pass runs on a copy of the image downscaled by this factor
+# (1.0 - full resolution; at 0.5 faces smaller than about 48 px are no longer found)
+FACE_DETECTION_SCALE = 1.0
 
 # Функция для чтения изображений и их меток из заданной директории
+# Изображения декодируются в пуле процессов только при первом запуске, затем читаются из кэша .npy
+# Возвращает FaceDataset: изображения, метки (labels) и имена файлов (names)
 def get_images(path):
-    image_paths = [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.jpg')]
-    images = []
-    labels = []
-    for image_path in image_paths:
-        image = Image.open(image_path).convert('L')
-        images.append(np.array(image))
-        # Извлекаем метку из имени файла
-        file_name = os.path.splitext(os.path.basename(image_path))[0]
-        label = 0  # Метка по умолчанию
-        split_name = file_name.split("subject")
-        if len(split_name) > 1:
-            label = int(split_name[1])
-        labels.append(label)
-    return images, labels
+    return load_dataset(path, face_size=FACE_SIZE)
 
 
 # Function to detect and display faces on the image
-def recognize_and_display_face(image, image_path, output_path):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = faceCascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-    
-    # Create a new figure
-    fig, ax = plt.subplots(figsize=(10, 10))
-    
-    # Display the original image
-    ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+# Rectangles are drawn directly on the image, which is saved at its original resolution
+# Returns True if the processed image was written
+def recognize_and_display_face(image, image_path, output_path, face_detector, jpeg_quality=JPEG_QUALITY):
+    faces = face_detector.detect(image)
     
     # Draw rectangles around detected faces
     for (x, y, w, h) in faces:
-        rect = patches.Rectangle((x, y), w, h, linewidth=2, edgecolor='r', facecolor='none')
-        ax.add_patch(rect)
+        cv2.rectangle(image, (x, y), (x + w, y + h), (0, 0, 255), 2)
     
     output_file = os.path.join(output_path, os.path.splitext(os.path.basename(image_path))[0] + '_processed.jpg')
-    plt.savefig(output_file)
-    plt.close(fig)
+    # imencode + tofile instead of imwrite: cv2.imwrite can not open non-ASCII paths on Windows
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    if not ok:
+        return False
+    encoded.tofile(output_file)
+    return True
 
-# Path to the Haar cascade file for face detection
-cascadePath = r"C:\Users\song_\Downloads\haarcascade_frontalface_default.xml"
-faceCascade = cv2.CascadeClassifier(cascadePath)
 
-# Path to the directory with training images
-input_path = r'C:\Users\song_\Downloads\faces'
+# Every output process keeps its own face detector and settings
+worker_detector = None
+worker_settings = None
 
-# Get images and their labels for training
-images, labels = get_images(input_path)
-print("Training started...")
 
-# Train the recognizer
-recognizer = cv2.face.LBPHFaceRecognizer_create()
-recognizer.train(images, np.array(labels))
-print("Training completed. The program successfully detected faces in the image.")
+def init_output_worker(cascade_path, input_dir, output_dir, jpeg_quality, detection_scale):
+    global worker_detector, worker_settings
+    worker_detector = FaceDetector(cascade_path, detection_scale=detection_scale, min_size=(30, 30))
+    worker_settings = (input_dir, output_dir, jpeg_quality)
 
-# Path to the directory where processed images will be saved
-output_path = r'C:\Users\song_\Downloads\КЗ 211-172 Газизова Алина Андреевна лабы\8'
 
-# Create the directory if it doesn't exist
-if not os.path.exists(output_path):
-    os.makedirs(output_path)
+# Function for the output pool: read, detect, draw and encode one image; returns (image_path, error)
+def process_output_image(image_path):
+    input_dir, output_dir, jpeg_quality = worker_settings
+    try:
+        # np.fromfile + imdecode also works with non-ASCII paths on Windows
+        data = np.fromfile(os.path.join(input_dir, image_path), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+        if image is None:
+            return image_path, "failed to read"
+        if not recognize_and_display_face(image, image_path, output_dir, worker_detector, jpeg_quality):
+            return image_path, "failed to encode"
+    except OSError as e:
+        return image_path, str(e)
+    return image_path, None
+
+
+# Function to recognize every face of the probe directory in one batch
+# LBP histograms of the whole gallery and of all probes are computed at once and matched with the
+# chi-square distance, instead of calling recognizer.predict once per face.
+# With several shards the identities are split between worker processes and queried in parallel.
+def recognize_directory(gallery_path, probe_path, face_size=RECOGNITION_FACE_SIZE, shards=GALLERY_SHARDS):
+    probes = load_dataset(probe_path, face_size=face_size)
+    if shards == 1:
+        gallery_faces = load_dataset(gallery_path, face_size=face_size)
+        gallery = LbpGallery()
+        gallery.add(gallery_faces.data, gallery_faces.labels)
+        return match_probes(gallery, probes)
+    with ShardedLbpGallery(gallery_path, face_size, shards) as gallery:
+        return match_probes(gallery, probes)
+
+
+def match_probes(gallery, probes):
+    if len(probes) == 0 or len(gallery) == 0:
+        return []
+    labels, distances = gallery.query(probes.data, k=1)
+    return list(zip(probes.names, labels[:, 0].tolist(), distances[:, 0].tolist()))
+
+
+def main():
+    # Get images and their labels for training
+    dataset = get_images(input_path)
+    print("Training started...")
+
+    # Train the recognizer, or load the saved model if the dataset has not changed
+    recognizer, status = load_or_train_recognizer(dataset, MODEL_PATH)
+    print("Training completed ({}). The program successfully detected faces in the image.".format(status))
+
+    if PROBE_PATH is not None:
+        for name, label, distance in recognize_directory(input_path, PROBE_PATH):
+            print("{}: subject {:02d} (distance {:.3f})".format(name, label, distance))
+
+    # Create the directory if it doesn't exist
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    # Display processed images (detection and encoding run in a pool of processes)
+    with ProcessPoolExecutor(max_workers=OUTPUT_WORKERS, initializer=init_output_worker,
+                             initargs=(cascadePath, input_path, output_path, JPEG_QUALITY,
+                                       FACE_DETECTION_SCALE)) as executor:
+        failed = 0
+        for image_path, error in executor.map(process_output_image, dataset.names, chunksize=16):
+            if error:
+                print("{}: {}".format(image_path, error))
+                failed += 1
+
+    if failed:
+        print("{} of {} images could not be processed.".format(failed, len(dataset.names)))
+    else:
+        print("The program processed all images in the directory and saved them with the _processed.jpg suffix in the recognized_faces folder.")
 
-# Display processed images
-for image_path in os.listdir(input_path):
-    if image_path.endswith('.jpg'):
-        image = cv2.imread(os.path.join(input_path, image_path))
-        recognize_and_display_face(image, image_path, output_path)
 
-print("The program processed all images in the directory and saved them with the _processed.jpg suffix in the recognized_faces folder.")
+# The pool of processes in face_dataset imports this module again, so the work runs only in main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+# Columns of the blob array returned by extract_blobs
+BLOB_X, BLOB_Y, BLOB_W, BLOB_H, BLOB_AREA = range(5)
+
+
+# Function for the optional morphological cleanup of a binary mask (opening removes specks,
+# closing fills small holes)
+def clean_mask(mask, kernel_size=3):
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+
+# Function to label the blobs of a binary mask
+# Returns the label image and an int32 array of rows (x, y, w, h, area) for labels 1..N
+def label_blobs(mask, kernel_size=0, connectivity=8):
+    if kernel_size:
+        mask = clean_mask(mask, kernel_size)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=connectivity)
+    # Row 0 is the background
+    return labels, stats[1:]
+
+
+# Function to find blobs on a binary mask, filtered by area without a Python loop
+# Returns an int32 array of rows (x, y, w, h, area)
+def extract_blobs(mask, min_area=0, max_area=None, kernel_size=0, connectivity=8):
+    _, stats = label_blobs(mask, kernel_size, connectivity)
+    keep = stats[:, BLOB_AREA] >= min_area
+    if max_area is not None:
+        keep &= stats[:, BLOB_AREA] <= max_area
+    return stats[keep]
+
+
+# Function to keep only the blobs with area >= min_area on the mask
+def filter_blobs(mask, min_area=0, kernel_size=0, connectivity=8):
+    labels, stats = label_blobs(mask, kernel_size, connectivity)
+    lut = np.zeros(len(stats) + 1, dtype=np.uint8)
+    lut[1:][stats[:, BLOB_AREA] >= min_area] = 255
+    return lut[labels]
@@ -0,0 +1,45 @@
+# Class for the input of a dataflow graph (e.g. the current frame)
+# The version changes only when a different object is set, so setting the same frame again costs nothing
+class SourceNode:
+    def __init__(self):
+        self.value = None
+        self.version = 0
+
+    def set(self, value):
+        if value is not self.value:
+            self.value = value
+            self.version += 1
+
+    def evaluate(self):
+        return self.value
+
+
+# Class for a node of a dataflow graph: value = function(*input values, **params)
+# The value is cached and recomputed only when the version of an input or a parameter has changed,
+# so a node shared by several branches is computed once. A disabled node, or a node whose input
+# has no value, gives None and does no work.
+class Node:
+    def __init__(self, function, *inputs, **params):
+        self.function = function
+        self.inputs = inputs
+        self.params = params
+        self.enabled = True
+        self.value = None
+        self.version = 0
+        self.key = None
+
+    def set_params(self, **params):
+        self.params.update(params)
+
+    def evaluate(self):
+        if not self.enabled:
+            return None
+        values = [node.evaluate() for node in self.inputs]
+        if any(value is None for value in values):
+            return None
+        key = (tuple(node.version for node in self.inputs), tuple(sorted(self.params.items())))
+        if key != self.key:
+            self.value = self.function(*values, **self.params)
+            self.key = key
+            self.version += 1
+        return self.value
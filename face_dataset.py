@@ -0,0 +1,159 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+CACHE_DIR_NAME = '.dataset_cache'
+# Arrays of a dataset cache, one .npy file each
+CACHE_PARTS = ('data', 'labels', 'offsets', 'shapes')
+
+
+# Function to get the label from a file name of the form "subjectNN..." (0 if there is none)
+def label_from_name(file_name):
+    label = 0  # Метка по умолчанию
+    split_name = os.path.splitext(file_name)[0].split("subject")
+    if len(split_name) > 1:
+        label = int(split_name[1])
+    return label
+
+
+# Function to list the dataset: sorted (name, size, mtime) of every .jpg file in the directory
+def dataset_manifest(path, extension='.jpg'):
+    manifest = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(extension):
+                stat = entry.stat()
+                manifest.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return sorted(manifest)
+
+
+def manifest_key(manifest, face_size):
+    digest = hashlib.sha1(repr((face_size, manifest)).encode())
+    return digest.hexdigest()[:16]
+
+
+def read_gray(path, face_size=None):
+    image = np.asarray(Image.open(path).convert('L'))
+    if face_size is not None and (image.shape[1], image.shape[0]) != tuple(face_size):
+        image = cv2.resize(image, tuple(face_size), interpolation=cv2.INTER_AREA)
+    return image
+
+
+def image_shape(path):
+    with Image.open(path) as image:
+        return image.height, image.width
+
+
+# Worker: decodes a chunk of images straight into the preallocated memory-mapped array
+def decode_chunk(array_path, jobs, face_size):
+    array = np.load(array_path, mmap_mode='r+')
+    for index, image_path, offset in jobs:
+        image = read_gray(image_path, face_size)
+        if face_size is not None:
+            array[index] = image
+        else:
+            array[offset:offset + image.size] = image.ravel()
+    array.flush()
+    return len(jobs)
+
+
+# Class for a face dataset held in one contiguous uint8 array
+# With face_size every face is normalized to (width, height) and the array has shape (N, height, width).
+# Without it the faces are stored one after another in a flat array, described by an offsets table
+# and a shapes table.
+class FaceDataset:
+    def __init__(self, names, labels, data, offsets=None, shapes=None, manifest=None, face_size=None):
+        self.names = names
+        self.manifest = manifest
+        self.face_size = face_size
+        self.labels = labels
+        self.data = data
+        self.offsets = offsets
+        self.shapes = shapes
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if self.offsets is None:
+            return self.data[index]
+        height, width = self.shapes[index]
+        offset = self.offsets[index]
+        return self.data[offset:offset + height * width].reshape(height, width)
+
+    # Method to get the faces as a list of views into the array (nothing is copied)
+    def images(self):
+        return [self[i] for i in range(len(self))]
+
+
+# Function to get the tag of the face size in the cache file names ("orig" or "100x100")
+def size_tag(face_size):
+    return "orig" if face_size is None else "{}x{}".format(*face_size)
+
+
+def cache_paths(cache_dir, key, tag):
+    return {part: os.path.join(cache_dir, "{}_{}_{}.npy".format(part, tag, key))
+            for part in CACHE_PARTS}
+
+
+# Function to load the dataset, decoding it in a process pool only if the cache is missing or stale
+# The cache is keyed by the manifest of names, sizes and modification times, and the pixel array
+# is opened memory-mapped, so reloading costs almost nothing and the data is not duplicated in memory.
+def load_dataset(path, face_size=None, cache_dir=None, workers=None, chunk_size=64):
+    manifest = dataset_manifest(path)
+    names = [name for name, _, _ in manifest]
+    labels = np.array([label_from_name(name) for name in names], dtype=np.int32)
+    cache_dir = cache_dir or os.path.join(path, CACHE_DIR_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    tag = size_tag(face_size)
+    paths = cache_paths(cache_dir, manifest_key(manifest, face_size), tag)
+
+    if not os.path.exists(paths['data']):
+        remove_stale_cache(cache_dir, tag)
+        build_cache(path, names, labels, face_size, paths, workers, chunk_size)
+
+    data = np.load(paths['data'], mmap_mode='r')
+    labels = np.load(paths['labels'])
+    if face_size is not None:
+        return FaceDataset(names, labels, data, manifest=manifest, face_size=face_size)
+    return FaceDataset(names, labels, data, np.load(paths['offsets']), np.load(paths['shapes']),
+                       manifest, face_size)
+
+
+# Caches of other face sizes are kept: training and recognition may use different sizes
+# Only the files of the cache itself are removed, other .npy files in the directory are left alone
+def remove_stale_cache(cache_dir, tag):
+    prefixes = tuple("{}_{}_".format(part, tag) for part in CACHE_PARTS)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') and name.startswith(prefixes):
+            os.remove(os.path.join(cache_dir, name))
+
+
+def build_cache(path, names, labels, face_size, paths, workers, chunk_size):
+    image_paths = [os.path.join(path, name) for name in names]
+    tmp_path = paths['data'] + '.tmp.npy'
+    if face_size is not None:
+        width, height = face_size
+        offsets = [0] * len(names)
+        np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(len(names), height, width)).flush()
+    else:
+        # Only the headers are read here to get the image sizes for the offsets table
+        shapes = np.array([image_shape(p) for p in image_paths], dtype=np.int64).reshape(-1, 2)
+        sizes = shapes[:, 0] * shapes[:, 1]
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(int(sizes.sum()),)).flush()
+        np.save(paths['offsets'], offsets)
+        np.save(paths['shapes'], shapes)
+
+    jobs = [(i, image_paths[i], int(offsets[i])) for i in range(len(names))]
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if chunks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(decode_chunk, [tmp_path] * len(chunks), chunks, [face_size] * len(chunks)))
+    np.save(paths['labels'], labels)
+    # The array becomes visible to the cache only after all images were decoded
+    os.replace(tmp_path, paths['data'])
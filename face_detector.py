@@ -0,0 +1,158 @@
+import cv2
+import numpy as np
+
+# Path to the Haar cascade shipped with OpenCV
+DEFAULT_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+
+
+# Function to clip boxes (x, y, w, h) to an image of the given shape, so that image[y:y+h, x:x+w]
+# always has the size (w, h) of the box; boxes scaled back from the downscaled image can stick out by a pixel
+def clip_boxes(boxes, shape):
+    height, width = shape[:2]
+    x0 = np.clip(boxes[:, 0], 0, width)
+    y0 = np.clip(boxes[:, 1], 0, height)
+    x1 = np.clip(boxes[:, 0] + boxes[:, 2], 0, width)
+    y1 = np.clip(boxes[:, 1] + boxes[:, 3], 0, height)
+    clipped = np.stack([x0, y0, x1 - x0, y1 - y0], axis=1).astype(np.int32)
+    # Boxes left with no area are dropped
+    return clipped[(clipped[:, 2] > 0) & (clipped[:, 3] > 0)]
+
+
+# Class for face detection: the cascade is loaded once and reused for every image or frame
+class FaceDetector:
+    def __init__(self, cascade_path=DEFAULT_CASCADE_PATH, detection_scale=1.0, min_size=(30, 30),
+                 scale_factor=1.1, min_neighbors=5):
+        if not 0 < detection_scale <= 1:
+            raise ValueError("detection_scale must be in (0, 1]")
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        if self.cascade.empty():
+            raise IOError("Failed to load cascade: " + cascade_path)
+        self.detection_scale = detection_scale
+        self.min_size = min_size
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    # Method to get a downscaled grayscale copy of the image for the cascade
+    def prepare(self, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.detection_scale != 1.0:
+            gray = cv2.resize(gray, None, fx=self.detection_scale, fy=self.detection_scale,
+                              interpolation=cv2.INTER_AREA)
+        return gray
+
+    # Method to detect faces; boxes (x, y, w, h) are returned in full-resolution coordinates
+    def detect(self, image):
+        small = self.prepare(image)
+        # min_size is given for the full-resolution image, so it is scaled together with the image
+        min_size = (max(1, int(round(self.min_size[0] * self.detection_scale))),
+                    max(1, int(round(self.min_size[1] * self.detection_scale))))
+        faces = self.cascade.detectMultiScale(small, scaleFactor=self.scale_factor,
+                                              minNeighbors=self.min_neighbors, minSize=min_size)
+        if len(faces) == 0:
+            return np.empty((0, 4), dtype=np.int32)
+        boxes = np.round(np.asarray(faces, dtype=np.float64) / self.detection_scale).astype(np.int32)
+        return clip_boxes(boxes, image.shape)
+
+
+# Class for video face detection: the cascade runs every N frames (or when tracking confidence
+# drops), and in between the boxes are carried forward with pyramidal Lucas-Kanade optical flow
+# on corner points inside each box
+class FaceTracker:
+    def __init__(self, detector, detect_every=10, min_confidence=0.5, min_points=4,
+                 max_points=30, max_fb_error=1.0):
+        self.detector = detector
+        self.detect_every = max(1, detect_every)
+        # Share of the points found at detection time that must still be tracked
+        self.min_confidence = min_confidence
+        self.min_points = min_points
+        self.max_points = max_points
+        # Maximum forward-backward error (in pixels of the downscaled frame) for a point to be kept
+        self.max_fb_error = max_fb_error
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self.reset_requested = False
+        self.reset()
+
+    def reset(self):
+        self.prev_gray = None
+        self.boxes = np.empty((0, 4), dtype=np.float64)
+        self.points = []
+        self.initial_counts = []
+        self.frames_since_detection = 0
+        self.confidence = 0.0
+
+    # Method to ask for a reset from another thread; it is applied on the next update
+    def request_reset(self):
+        self.reset_requested = True
+
+    # Method to get the face boxes (x, y, w, h) for the next frame of the video
+    def update(self, frame):
+        if self.reset_requested:
+            self.reset_requested = False
+            self.reset()
+        gray = self.detector.prepare(frame)
+        need_detection = self.prev_gray is None or self.frames_since_detection + 1 >= self.detect_every
+        if not need_detection:
+            need_detection = not self.track(gray)
+        if need_detection:
+            self.detect(frame, gray)
+        else:
+            self.frames_since_detection += 1
+        self.prev_gray = gray
+        return clip_boxes(np.round(self.boxes).astype(np.int32).reshape(-1, 4), frame.shape)
+
+    def detect(self, frame, gray):
+        self.boxes = self.detector.detect(frame).astype(np.float64)
+        self.points = [self.find_points(gray, box) for box in self.boxes]
+        self.initial_counts = [len(points) for points in self.points]
+        self.frames_since_detection = 0
+        self.confidence = 1.0
+
+    # Method to find corner points inside the box, in coordinates of the downscaled frame
+    def find_points(self, gray, box):
+        scale = self.detector.detection_scale
+        x, y, w, h = np.round(box * scale).astype(int)
+        mask = np.zeros_like(gray)
+        mask[max(y, 0):y + h, max(x, 0):x + w] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=self.max_points, qualityLevel=0.01,
+                                         minDistance=3, mask=mask)
+        if points is None:
+            return np.empty((0, 1, 2), dtype=np.float32)
+        return points.astype(np.float32)
+
+    # Method to move the boxes with optical flow; returns False when the faces must be detected again
+    def track(self, gray):
+        if len(self.boxes) == 0:
+            return True
+        counts = [len(points) for points in self.points]
+        if min(counts) < self.min_points:
+            return False
+        p0 = np.concatenate(self.points)
+        owners = np.repeat(np.arange(len(self.points)), counts)
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, p0, None, **self.lk_params)
+        p0_back, st_back, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, p1, None, **self.lk_params)
+        fb_error = np.abs(p0 - p0_back).reshape(-1, 2).max(axis=1)
+        good = (st.ravel() == 1) & (st_back.ravel() == 1) & (fb_error < self.max_fb_error)
+
+        scale = self.detector.detection_scale
+        height, width = gray.shape[:2]
+        boxes = self.boxes.copy()
+        points = []
+        confidence = 1.0
+        for i in range(len(boxes)):
+            selected = good & (owners == i)
+            count = int(selected.sum())
+            confidence = min(confidence, count / max(self.initial_counts[i], 1))
+            if count < self.min_points or confidence < self.min_confidence:
+                return False
+            shift = np.median((p1[selected] - p0[selected]).reshape(-1, 2), axis=0)
+            boxes[i, :2] += shift / scale
+            x, y, w, h = boxes[i] * scale
+            # A face leaving the frame is detected again instead of being tracked outside it
+            if x < 0 or y < 0 or x + w > width or y + h > height:
+                return False
+            points.append(p1[selected])
+        self.boxes = boxes
+        self.points = points
+        self.confidence = confidence
+        return True
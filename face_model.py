@@ -0,0 +1,64 @@
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+def fingerprint_path(model_path):
+    return os.path.splitext(model_path)[0] + '.manifest.json'
+
+
+def read_fingerprint(model_path):
+    try:
+        with open(fingerprint_path(model_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Function to save the model together with the fingerprint of the dataset it was trained on
+def save_recognizer(recognizer, model_path, dataset):
+    directory = os.path.dirname(model_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written to temporary files first so that an interrupted run does not leave a broken model
+    root, extension = os.path.splitext(model_path)
+    tmp_model_path = root + '.tmp' + extension
+    recognizer.write(tmp_model_path)
+    fingerprint = {
+        "face_size": list(dataset.face_size) if dataset.face_size is not None else None,
+        "manifest": [list(entry) for entry in dataset.manifest],
+    }
+    tmp_fingerprint_path = fingerprint_path(model_path) + '.tmp'
+    with open(tmp_fingerprint_path, 'w', encoding='utf-8') as f:
+        json.dump(fingerprint, f)
+    os.replace(tmp_model_path, model_path)
+    os.replace(tmp_fingerprint_path, fingerprint_path(model_path))
+
+
+# Function to get a trained LBPH recognizer for the dataset
+# If the saved fingerprint matches the dataset, the model is only loaded. If images were only added,
+# the saved model is updated with the new images. Otherwise the model is trained from scratch.
+# Returns the recognizer and one of "loaded", "updated", "trained".
+def load_or_train_recognizer(dataset, model_path):
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    manifest = [list(entry) for entry in dataset.manifest]
+    face_size = list(dataset.face_size) if dataset.face_size is not None else None
+    saved = read_fingerprint(model_path)
+
+    if saved is not None and saved["face_size"] == face_size and os.path.exists(model_path):
+        saved_entries = set(map(tuple, saved["manifest"]))
+        current_entries = set(map(tuple, manifest))
+        if saved_entries <= current_entries:
+            recognizer.read(model_path)
+            new_indices = [i for i, entry in enumerate(manifest) if tuple(entry) not in saved_entries]
+            if not new_indices:
+                return recognizer, "loaded"
+            recognizer.update([dataset[i] for i in new_indices], dataset.labels[new_indices])
+            save_recognizer(recognizer, model_path, dataset)
+            return recognizer, "updated"
+
+    recognizer.train(dataset.images(), np.asarray(dataset.labels))
+    save_recognizer(recognizer, model_path, dataset)
+    return recognizer, "trained"
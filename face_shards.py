@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from face_dataset import load_dataset
+from lbp import LbpGallery, lbp_histograms
+
+
+# Function to split the identities of the dataset between shards
+# All faces of one label go to the same shard; the largest identities are placed first,
+# each on the shard with the fewest faces so far. Returns a list of index arrays, one per shard.
+def partition_labels(labels, shard_count):
+    labels = np.asarray(labels)
+    unique, counts = np.unique(labels, return_counts=True)
+    loads = [0] * shard_count
+    owner = {}
+    for label, count in sorted(zip(unique.tolist(), counts.tolist()), key=lambda item: -item[1]):
+        shard = loads.index(min(loads))
+        owner[label] = shard
+        loads[shard] += count
+    shard_of_face = np.array([owner[label] for label in labels.tolist()], dtype=np.int32)
+    return [np.flatnonzero(shard_of_face == shard) for shard in range(shard_count)]
+
+
+# Every shard process keeps its part of the gallery
+worker_gallery = None
+
+
+def init_shard_worker(dataset_path, face_size, indices, grid, metric):
+    global worker_gallery
+    # The dataset is already cached by the router, so here it is only opened memory-mapped
+    dataset = load_dataset(dataset_path, face_size=face_size)
+    worker_gallery = LbpGallery(grid, metric)
+    if len(indices):
+        worker_gallery.add(dataset.data[indices], dataset.labels[indices])
+
+
+def query_shard(histograms, k):
+    return worker_gallery.query_histograms(histograms, k)
+
+
+# Function to merge per-shard top-k results into the global top-k, nearest first
+def merge_top_k(results, k):
+    labels = np.concatenate([labels for labels, _ in results], axis=1)
+    distances = np.concatenate([distances for _, distances in results], axis=1)
+    order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(labels, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+# Class for a face gallery split into shards, each held by its own worker process
+# The router computes the probe histograms once, sends the batch to every shard and merges
+# the per-shard top-k results. Every shard owns whole identities, so it can be queried independently.
+class ShardedLbpGallery:
+    def __init__(self, dataset_path, face_size=(100, 100), shard_count=None, grid=(8, 8), metric="chi2"):
+        self.grid = grid
+        dataset = load_dataset(dataset_path, face_size=face_size)
+        self.size = len(dataset)
+        shard_count = max(1, min(shard_count or os.cpu_count(), len(np.unique(dataset.labels)) or 1))
+        self.shards = []
+        for indices in partition_labels(dataset.labels, shard_count):
+            self.shards.append(ProcessPoolExecutor(max_workers=1, initializer=init_shard_worker,
+                                                   initargs=(dataset_path, face_size, indices, grid, metric)))
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for shard in self.shards:
+            shard.shutdown()
+        self.shards = []
+
+    # Method to find the k nearest gallery faces for every probe face
+    # Returns (labels, distances), both of shape (number of probes, k), nearest first
+    def query(self, faces, k=1):
+        return self.query_histograms(lbp_histograms(faces, self.grid), k)
+
+    def query_histograms(self, histograms, k=1):
+        if self.size == 0:
+            raise ValueError("The gallery is empty")
+        futures = [shard.submit(query_shard, histograms, k) for shard in self.shards]
+        return merge_top_k([future.result() for future in futures], min(k, self.size))
@@ -0,0 +1,77 @@
+import collections
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from tiled_features import array_to_keypoints, extract_orb_tiled, keypoints_to_array
+
+
+# Class for caching ORB keypoints and descriptors per image
+# Entries are keyed by a hash of the image content and the ORB parameters. They are kept in memory
+# and, if cache_dir is given, also as .npz files that survive restarts.
+# Images with at least tiled_min_pixels pixels are processed by the tiled parallel extractor.
+class OrbFeatureCache:
+    def __init__(self, cache_dir=None, max_items=256, tiled_min_pixels=None, features_per_tile=500, **orb_params):
+        self.orb_params = orb_params
+        self.orb = cv2.ORB_create(**orb_params)
+        self.tiled_min_pixels = tiled_min_pixels
+        self.features_per_tile = features_per_tile
+        self.params_key = repr((sorted(orb_params.items()), tiled_min_pixels, features_per_tile))
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.max_items = max_items
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image):
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(self.params_key.encode())
+        digest.update(repr((image.shape, image.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    # Method to get packed keypoints and descriptors of the image; extraction runs only on a cache miss
+    def compute_arrays(self, image):
+        key = self.key(image)
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.cache_dir and os.path.exists(self.path(key)):
+            with np.load(self.path(key)) as data:
+                entry = (data["keypoints"], data["descriptors"])
+            self.hits += 1
+        else:
+            entry = self.extract(image)
+            self.misses += 1
+            if self.cache_dir:
+                # Written to a temporary file first so that an interrupted run does not leave a broken entry
+                tmp_path = self.path(key) + ".tmp.npz"
+                np.savez(tmp_path, keypoints=entry[0], descriptors=entry[1])
+                os.replace(tmp_path, self.path(key))
+        self.memory[key] = entry
+        if len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+        return entry
+
+    def extract(self, image):
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.tiled_min_pixels and gray.size >= self.tiled_min_pixels:
+            return extract_orb_tiled(gray, self.features_per_tile, **self.orb_params)
+        keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        if descriptors is None:
+            descriptors = np.empty((0, 32), dtype=np.uint8)
+        return keypoints_to_array(keypoints), descriptors
+
+    # Method with the same result as orb.detectAndCompute: a list of cv2.KeyPoint and descriptors (or None)
+    def compute(self, image):
+        keypoints, descriptors = self.compute_arrays(image)
+        return array_to_keypoints(keypoints), (descriptors if len(descriptors) else None)
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+
+# Class for continuous feature tracking on a video stream
+# Every frame is converted to grayscale once and kept as the "previous" frame for the next step.
+# (The Python bindings of calcOpticalFlowPyrLK do not accept pyramids from buildOpticalFlowPyramid,
+# so LK builds them itself.) Tracks are checked with forward-backward optical flow, and
+# goodFeaturesToTrack runs again only when the number of live points drops below min_points,
+# and only away from existing tracks.
+class StreamingFeatureTracker:
+    def __init__(self, max_corners=100, quality_level=0.01, min_distance=10, min_points=50,
+                 win_size=(21, 21), max_level=3, max_fb_error=1.0):
+        self.max_corners = max_corners
+        self.quality_level = quality_level
+        self.min_distance = min_distance
+        self.min_points = min_points
+        self.win_size = win_size
+        self.max_level = max_level
+        self.max_fb_error = max_fb_error
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        self.reset()
+
+    def reset(self):
+        self.prev_gray = None
+        self.points = np.empty((0, 1, 2), dtype=np.float32)
+        self.detections = 0
+
+    def flow(self, prev_gray, next_gray, points):
+        return cv2.calcOpticalFlowPyrLK(prev_gray, next_gray, points, None, winSize=self.win_size,
+                                        maxLevel=self.max_level, criteria=self.criteria)
+
+    # Method to process the next frame
+    # Returns (new_points, old_points) of the tracks that survived, as Nx2 float32 arrays
+    def update(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        good_new = good_old = np.empty((0, 2), dtype=np.float32)
+
+        if self.prev_gray is not None and len(self.points):
+            p1, st, _ = self.flow(self.prev_gray, gray, self.points)
+            p0_back, st_back, _ = self.flow(gray, self.prev_gray, p1)
+            fb_error = np.abs(self.points - p0_back).reshape(-1, 2).max(axis=1)
+            good = (st.ravel() == 1) & (st_back.ravel() == 1) & (fb_error < self.max_fb_error)
+            good_new = p1[good].reshape(-1, 2)
+            good_old = self.points[good].reshape(-1, 2)
+            self.points = p1[good].reshape(-1, 1, 2)
+
+        if len(self.points) < self.min_points:
+            self.detect(gray)
+
+        self.prev_gray = gray
+        return good_new, good_old
+
+    # Method to add new corners in the areas without live tracks
+    def detect(self, gray):
+        mask = np.full(gray.shape, 255, dtype=np.uint8)
+        for x, y in self.points.reshape(-1, 2):
+            cv2.circle(mask, (int(x), int(y)), self.min_distance, 0, -1)
+        new_points = cv2.goodFeaturesToTrack(gray, maxCorners=self.max_corners - len(self.points),
+                                             qualityLevel=self.quality_level, minDistance=self.min_distance,
+                                             mask=mask)
+        self.detections += 1
+        if new_points is not None:
+            self.points = np.concatenate([self.points, new_points.astype(np.float32)])
@@ -0,0 +1,94 @@
+import collections
+import threading
+import time
+
+import cv2
+
+
+# Class for reading video frames in a background thread into a small ring buffer
+# The UI always gets the newest frame; older unread frames are dropped and counted.
+class ThreadedFrameSource:
+    def __init__(self, source, buffer_size=2):
+        self.capture = cv2.VideoCapture(source)
+        self.is_camera = isinstance(source, int)
+        if self.is_camera:
+            # Keep the driver queue short so that frames do not pile up in the camera buffer
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.finished = False
+        # Counters
+        self.captured = 0
+        self.displayed = 0
+        self.dropped = 0
+        self.latency = 0.0
+        self.average_latency = 0.0
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # The capture is released by the capture thread when its loop exits, because after the join timeout
+    # the thread may still be inside capture.read(); here it is released only if the thread was never started
+    def release(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=1.0)
+        if self.thread.ident is None:
+            self.capture.release()
+
+    # Capture thread; video files are paced to their frame rate, cameras are read as fast as they deliver
+    def run(self):
+        try:
+            self.read_frames()
+        finally:
+            self.capture.release()
+            self.finished = True
+
+    def read_frames(self):
+        period = 1.0 / self.fps
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            ret, frame = self.capture.read()
+            if not ret:
+                break
+            timestamp = time.perf_counter()
+            with self.lock:
+                if len(self.buffer) == self.buffer.maxlen:
+                    self.dropped += 1
+                self.buffer.append((timestamp, frame))
+                self.captured += 1
+            if not self.is_camera:
+                next_time = max(next_time + period, timestamp - period)
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    # Method to get the newest frame, or None if no new frame was captured since the last call
+    def read(self):
+        with self.lock:
+            if not self.buffer:
+                return None
+            timestamp, frame = self.buffer.pop()
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+        self.displayed += 1
+        # Capture-to-display latency of the frame handed to the UI
+        self.latency = time.perf_counter() - timestamp
+        self.average_latency = 0.9 * self.average_latency + 0.1 * self.latency if self.displayed > 1 else self.latency
+        return frame
+
+    # Method to check whether the source has ended and every frame was handed out or dropped
+    def is_finished(self):
+        with self.lock:
+            return self.finished and not self.buffer
+
+    def stats_text(self):
+        return "captured: {}, dropped: {}, latency: {:.0f} ms".format(
+            self.captured, self.dropped, self.average_latency * 1000)
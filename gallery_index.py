@@ -0,0 +1,93 @@
+import os
+
+import cv2
+import numpy as np
+
+from feature_cache import OrbFeatureCache
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+FLANN_INDEX_LSH = 6
+
+
+# Class for one-to-many image retrieval: ORB descriptors of a whole gallery are put into one
+# FLANN LSH index, and every query descriptor votes for the gallery image of its best match
+class OrbGalleryIndex:
+    def __init__(self, feature_cache=None, ratio=0.75, table_number=6, key_size=12, multi_probe_level=1, checks=50):
+        self.feature_cache = feature_cache or OrbFeatureCache()
+        self.ratio = ratio
+        index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=table_number, key_size=key_size,
+                            multi_probe_level=multi_probe_level)
+        self.matcher = cv2.FlannBasedMatcher(index_params, dict(checks=checks))
+        self.paths = []
+        self.keypoints = []
+        self.trained = False
+
+    def __len__(self):
+        return len(self.paths)
+
+    # Method to add one image to the gallery; images without enough features are skipped
+    def add(self, path, image=None):
+        if image is None:
+            image = cv2.imread(path)
+            if image is None:
+                return False
+        keypoints, descriptors = self.feature_cache.compute_arrays(image)
+        if len(descriptors) < 2:
+            return False
+        self.matcher.add([descriptors])
+        self.paths.append(path)
+        self.keypoints.append(keypoints[:, :2])
+        self.trained = False
+        return True
+
+    # Method to add every image of a directory; returns the number of indexed images
+    def add_directory(self, directory):
+        count = 0
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                count += self.add(os.path.join(directory, name))
+        return count
+
+    def train(self):
+        if self.paths and not self.trained:
+            self.matcher.train()
+            self.trained = True
+
+    # Method to find the top_k gallery images for the query image
+    # Returns a list of (path, good_matches, inliers); inliers is None without verification.
+    # With verify=True the shortlist is re-ranked by the number of RANSAC homography inliers.
+    def search(self, image, top_k=5, verify=False, shortlist=None, ransac_threshold=5.0):
+        if not self.paths:
+            return []
+        self.train()
+        query_keypoints, query_descriptors = self.feature_cache.compute_arrays(image)
+        if len(query_descriptors) < 2:
+            return []
+        knn_matches = self.matcher.knnMatch(query_descriptors, k=2)
+        good = [pair[0] for pair in knn_matches
+                if len(pair) == 2 and pair[0].distance < self.ratio * pair[1].distance]
+        if not good:
+            return []
+        image_indices = np.array([m.imgIdx for m in good])
+        votes = np.bincount(image_indices, minlength=len(self.paths))
+        shortlist = shortlist or (top_k * 3 if verify else top_k)
+        candidates = [int(i) for i in np.argsort(-votes, kind='stable')[:shortlist] if votes[i] > 0]
+
+        results = []
+        for i in candidates:
+            inliers = None
+            if verify:
+                inliers = self.verify(query_keypoints, [m for m in good if m.imgIdx == i], i, ransac_threshold)
+            results.append((self.paths[i], int(votes[i]), inliers))
+        if verify:
+            results.sort(key=lambda result: (result[2], result[1]), reverse=True)
+        return results[:top_k]
+
+    # Method to count RANSAC homography inliers between the query and one gallery image
+    def verify(self, query_keypoints, matches, image_index, ransac_threshold):
+        if len(matches) < 4:
+            return 0
+        src = query_keypoints[[m.queryIdx for m in matches], :2].reshape(-1, 1, 2)
+        dst = self.keypoints[image_index][[m.trainIdx for m in matches]].reshape(-1, 1, 2)
+        _, mask = cv2.findHomography(src, dst, cv2.RANSAC, ransac_threshold)
+        return 0 if mask is None else int(mask.sum())
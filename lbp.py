@@ -0,0 +1,113 @@
+import numpy as np
+
+# Neighbours of the 3x3 LBP operator, clockwise from the top-left pixel
+LBP_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+
+
+# Function to compute LBP codes (radius 1, 8 neighbours) for a batch of faces of shape (N, H, W)
+# Returns uint8 codes of shape (N, H - 2, W - 2)
+def lbp_codes(faces):
+    faces = np.asarray(faces)
+    height, width = faces.shape[1:]
+    center = faces[:, 1:-1, 1:-1]
+    codes = np.zeros(center.shape, dtype=np.uint8)
+    for bit, (dy, dx) in enumerate(LBP_OFFSETS):
+        neighbour = faces[:, 1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+        codes |= (neighbour >= center).astype(np.uint8) << bit
+    return codes
+
+
+# Function to get the grid cell index of every pixel of a (height, width) code image
+def cell_map(height, width, grid):
+    rows = np.minimum(np.arange(height) * grid[0] // height, grid[0] - 1)
+    cols = np.minimum(np.arange(width) * grid[1] // width, grid[1] - 1)
+    return rows[:, None] * grid[1] + cols[None, :]
+
+
+# Function to compute spatial LBP histograms for a batch of aligned faces (N, H, W)
+# Every cell histogram is normalized by the cell area. Returns a float32 matrix (N, grid cells * 256).
+def lbp_histograms(faces, grid=(8, 8), chunk_size=256):
+    faces = np.asarray(faces)
+    if faces.ndim != 3:
+        raise ValueError("faces must be an (N, H, W) batch of aligned grayscale faces")
+    count = len(faces)
+    cells = grid[0] * grid[1]
+    histograms = np.empty((count, cells * 256), dtype=np.float32)
+    cell_index = None
+    for start in range(0, count, chunk_size):
+        codes = lbp_codes(faces[start:start + chunk_size])
+        if cell_index is None:
+            cell_index = cell_map(codes.shape[1], codes.shape[2], grid)
+            cell_sizes = np.bincount(cell_index.ravel(), minlength=cells).astype(np.float32)
+        n = len(codes)
+        # One bincount for the whole chunk: bin = face * cells * 256 + cell * 256 + code
+        bins = (np.arange(n)[:, None, None] * (cells * 256) + cell_index[None] * 256 + codes).ravel()
+        chunk = np.bincount(bins, minlength=n * cells * 256).reshape(n, cells, 256).astype(np.float32)
+        chunk /= cell_sizes[None, :, None]
+        histograms[start:start + n] = chunk.reshape(n, -1)
+    return histograms
+
+
+# Function to compute the distance matrix (probes x gallery) between histograms
+# metric "chi2" - chi-square distance, "intersection" - 1 - normalized histogram intersection
+def histogram_distances(probes, gallery, metric="chi2", block_elements=1 << 24):
+    distances = np.empty((len(probes), len(gallery)), dtype=np.float32)
+    if len(probes) == 0 or len(gallery) == 0:
+        return distances
+    dims = probes.shape[1]
+    # Blocks are chosen so that the (probes, gallery, dims) temporary stays around block_elements
+    gallery_block = max(1, min(len(gallery), block_elements // dims))
+    probe_block = max(1, block_elements // (dims * gallery_block))
+    cells = gallery.sum(axis=1).max() if metric == "intersection" else None
+    for p in range(0, len(probes), probe_block):
+        probe = probes[p:p + probe_block, None, :]
+        for g in range(0, len(gallery), gallery_block):
+            item = gallery[None, g:g + gallery_block, :]
+            if metric == "chi2":
+                total = probe + item
+                difference = probe - item
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    terms = np.where(total > 0, difference * difference / total, 0)
+                distances[p:p + probe_block, g:g + gallery_block] = terms.sum(axis=2)
+            elif metric == "intersection":
+                similarity = np.minimum(probe, item).sum(axis=2)
+                distances[p:p + probe_block, g:g + gallery_block] = 1 - similarity / cells
+            else:
+                raise ValueError("Unknown metric: " + metric)
+    return distances
+
+
+# Class for nearest-neighbour face recognition on LBP histograms
+# Gallery histograms are stored as one matrix, and a whole batch of probes is matched in one call.
+class LbpGallery:
+    def __init__(self, grid=(8, 8), metric="chi2"):
+        self.grid = grid
+        self.metric = metric
+        self.histograms = np.empty((0, grid[0] * grid[1] * 256), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, faces, labels):
+        self.add_histograms(lbp_histograms(faces, self.grid), labels)
+
+    def add_histograms(self, histograms, labels):
+        self.histograms = np.vstack([self.histograms, histograms])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int32)])
+
+    # Method to find the k nearest gallery faces for every probe
+    # Returns (labels, distances), both of shape (number of probes, k), nearest first
+    def query(self, faces, k=1):
+        return self.query_histograms(lbp_histograms(faces, self.grid), k)
+
+    def query_histograms(self, histograms, k=1):
+        if len(self.labels) == 0:
+            raise ValueError("The gallery is empty")
+        k = min(k, len(self.labels))
+        distances = histogram_distances(histograms, self.histograms, self.metric)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        return self.labels[nearest], np.take_along_axis(nearest_distances, order, axis=1)
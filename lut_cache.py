@@ -0,0 +1,52 @@
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+# All 256 values of a uint8 channel, used to turn a point-wise function into a lookup table
+RAMP = np.arange(256, dtype=np.uint8).reshape(1, 256)
+
+# Number of tables of each kind kept in memory (one table is 256 or 768 bytes)
+LUT_CACHE_SIZE = 64
+
+
+# Function to build the lookup table of a point-wise uint8 function by running it on all 256 values,
+# so the table gives exactly the same results as the function itself (rounding and saturation included)
+def table_of(function):
+    table = np.ascontiguousarray(function(RAMP).reshape(256), dtype=np.uint8)
+    # The tables are shared through the cache, so they must not be changed by the callers
+    table.flags.writeable = False
+    return table
+
+
+# Function to get the table of cv2.convertScaleAbs(alpha=(contrast + 100) / 100, beta=brightness)
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def brightness_contrast_table(brightness=0, contrast=0):
+    alpha = (contrast + 100) / 100.0
+    return table_of(lambda ramp: cv2.convertScaleAbs(ramp, alpha=alpha, beta=brightness))
+
+
+# Function to get the table of cv2.threshold(image, threshold, max_value, threshold_type)
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def threshold_table(threshold, max_value=255, threshold_type=cv2.THRESH_BINARY):
+    return table_of(lambda ramp: cv2.threshold(ramp, threshold, max_value, threshold_type)[1])
+
+
+# Function to get a 3-channel table that shifts the hue (cyclically, OpenCV hue is 0..179)
+# and adds offsets to the saturation and value with saturation at 0 and 255
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def hsv_shift_table(hue=0, saturation=0, value=0):
+    values = np.arange(256, dtype=np.int32)
+    table = np.empty((1, 256, 3), dtype=np.uint8)
+    table[0, :, 0] = (values + hue) % 180
+    table[0, :, 1] = np.clip(values + saturation, 0, 255)
+    table[0, :, 2] = np.clip(values + value, 0, 255)
+    table.flags.writeable = False
+    return table
+
+
+# Function to apply a table; with inplace=True the result is written into the image itself
+def apply_lut(image, table, inplace=False):
+    if inplace:
+        return cv2.LUT(image, table, dst=image)
+    return cv2.LUT(image, table)
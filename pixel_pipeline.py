@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+
+from lut_cache import apply_lut, brightness_contrast_table, hsv_shift_table, table_of
+
+SEPIA_KERNEL = np.array([[0.272, 0.534, 0.131],
+                         [0.349, 0.686, 0.168],
+                         [0.393, 0.769, 0.189]])
+
+
+# Class for a point-wise operation given by a 256-entry lookup table (the same table for every channel)
+class LutOp:
+    def __init__(self, name, table):
+        self.name = name
+        self.table = np.asarray(table, dtype=np.uint8).reshape(256)
+
+    def apply(self, image):
+        return cv2.LUT(image, self.table)
+
+
+# Class for any other operation on the whole image; it always runs as a separate pass
+# new_array - the function always returns a new array (not a view of its input),
+# so the lookup tables after it may be applied to that array in place
+class StepOp:
+    def __init__(self, name, function, new_array=False):
+        self.name = name
+        self.function = function
+        self.new_array = new_array
+
+    def apply(self, image):
+        return self.function(image)
+
+
+def bgr_to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def sepia(image):
+    return cv2.transform(image, SEPIA_KERNEL)
+
+
+# Function to shift hue, saturation and value with one lookup of a 3-channel table in HSV space
+def hsv_shift(image, hue=0, saturation=0, value=0):
+    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    apply_lut(hsv_image, hsv_shift_table(hue, saturation, value), inplace=True)
+    return cv2.cvtColor(hsv_image, cv2.COLOR_HSV2BGR)
+
+
+def sepia_op():
+    return StepOp("sepia", sepia, new_array=True)
+
+
+def grayscale_op():
+    return StepOp("grayscale", bgr_to_gray, new_array=True)
+
+
+def channel_op(channel):
+    index = {"Red": 2, "Green": 1, "Blue": 0}.get(channel, 0)
+    return StepOp("channel " + channel, lambda image: image[:, :, index])
+
+
+def hsv_op(hue=0, saturation=0, value=0):
+    return StepOp("hsv", lambda image: hsv_shift(image, hue, saturation, value), new_array=True)
+
+
+def brightness_contrast_op(brightness=0, contrast=0):
+    return LutOp("brightness/contrast", brightness_contrast_table(brightness, contrast))
+
+
+def invert_op():
+    return LutOp("invert", table_of(cv2.bitwise_not))
+
+
+# Class for a chain of point-wise operations composed ahead of time into the fewest passes
+# Consecutive lookup tables are merged into one table, which gives exactly the same result as applying
+# them one by one, and a table after a pass that created a new array is applied to it in place.
+# Color matrices (sepia, grayscale) are not merged: cv2.transform rounds and saturates after every
+# operation, so the product of two matrices does not match running them one by one. The hsv operation
+# works on a 3-channel table in HSV space and also runs as a pass of its own.
+class PixelPipeline:
+    def __init__(self, operations=()):
+        self.operations = list(operations)
+        self.passes = None
+
+    def add(self, operation):
+        self.operations.append(operation)
+        self.passes = None
+        return self
+
+    # Method to compose the operations into passes
+    def compile(self):
+        passes = []
+        for operation in self.operations:
+            last = passes[-1] if passes else None
+            if isinstance(operation, LutOp) and isinstance(last, LutOp):
+                passes[-1] = LutOp(last.name + " + " + operation.name, operation.table[last.table])
+            else:
+                passes.append(operation)
+        self.passes = passes
+        return passes
+
+    def __call__(self, image):
+        if self.passes is None:
+            self.compile()
+        result = image
+        owned = False
+        for operation in self.passes:
+            if isinstance(operation, LutOp) and owned:
+                # The array was created by an earlier pass, so the table is applied in place
+                cv2.LUT(result, operation.table, dst=result)
+            else:
+                result = operation.apply(result)
+                owned = isinstance(operation, LutOp) or operation.new_array
+        return result
@@ -0,0 +1,56 @@
+import cv2
+
+# Size (width, height) of the canvases the GUIs show images on
+PREVIEW_SIZE = (400, 400)
+
+
+# Function to get the factor (<= 1) that fits an image of the given shape into max_size
+def fit_scale(shape, max_size=PREVIEW_SIZE):
+    height, width = shape[:2]
+    return min(1.0, max_size[0] / width, max_size[1] / height)
+
+
+# Function to downscale an image so that it fits into max_size; smaller images are returned as they are
+# interpolation - INTER_AREA for photos, INTER_NEAREST for masks
+def make_proxy(image, max_size=PREVIEW_SIZE, interpolation=cv2.INTER_AREA):
+    scale = fit_scale(image.shape, max_size)
+    if scale == 1.0:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=interpolation)
+
+
+# Class for preview editing: operations run on a cached downscaled proxy that fits the display,
+# and are recorded, so the same chain can be re-rendered on the full-resolution image when saving.
+# An operation is a function (image, scale, **params) -> new image (the input must not be changed);
+# scale is the proxy/full ratio (1.0 at full resolution), to adapt parameters given in pixels (areas).
+class PreviewSession:
+    def __init__(self, image, max_size=PREVIEW_SIZE):
+        self.full_image = image
+        self.proxy = make_proxy(image, max_size)
+        self.scale = self.proxy.shape[1] / image.shape[1]
+        self.operations = []
+        self.preview_image = self.proxy
+
+    def reset(self):
+        self.operations = []
+        self.preview_image = self.proxy
+
+    # Method to add an operation to the chain; only the new operation runs, on the cached proxy result
+    # result - the preview result if the caller has already computed it
+    def record(self, function, result=None, **params):
+        self.operations.append((function, params))
+        if result is None:
+            result = function(self.preview_image, self.scale, **params)
+        self.preview_image = result
+        return result
+
+    def render(self, image, scale):
+        for function, params in self.operations:
+            image = function(image, scale, **params)
+        return image
+
+    # Method to re-render the recorded chain on the full-resolution image
+    def render_full(self):
+        return self.render(self.full_image, 1.0)
@@ -0,0 +1,107 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+# Function to pack keypoints into a compact float32 array (x, y, size, angle, response, octave, class_id)
+def keypoints_to_array(keypoints):
+    return np.array([(kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response, kp.octave, kp.class_id)
+                     for kp in keypoints], dtype=np.float32).reshape(-1, 7)
+
+
+# Function to build cv2.KeyPoint objects back from the packed array
+def array_to_keypoints(array):
+    return [cv2.KeyPoint(float(x), float(y), float(size), float(angle), float(response), int(octave), int(class_id))
+            for x, y, size, angle, response, octave, class_id in array]
+
+
+# Function to split an image into a grid of tiles
+# Returns a list of (core, extended) rectangles (x0, y0, x1, y1): features are detected on the
+# extended tile, which overlaps its neighbours, and kept only if they lie inside the core tile.
+# So every feature is found once, with full context, and nothing is lost at the seams.
+def tile_grid(height, width, tile_size=1024, overlap=32):
+    rows = max(1, math.ceil(height / tile_size))
+    cols = max(1, math.ceil(width / tile_size))
+    ys = np.linspace(0, height, rows + 1).astype(int)
+    xs = np.linspace(0, width, cols + 1).astype(int)
+    tiles = []
+    for r in range(rows):
+        for c in range(cols):
+            core = (xs[c], ys[r], xs[c + 1], ys[r + 1])
+            extended = (max(0, core[0] - overlap), max(0, core[1] - overlap),
+                        min(width, core[2] + overlap), min(height, core[3] + overlap))
+            tiles.append((core, extended))
+    return tiles
+
+
+# Function to get a mask of points (Nx2, in image coordinates) lying inside the core rectangle
+def inside(points, core):
+    x0, y0, x1, y1 = core
+    return (points[:, 0] >= x0) & (points[:, 0] < x1) & (points[:, 1] >= y0) & (points[:, 1] < y1)
+
+
+def run_tiles(function, tiles, workers):
+    # OpenCV releases the GIL, so threads are enough to use all cores without copying tiles between processes
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(function, tiles))
+
+
+# Function to find corners (as goodFeaturesToTrack) tile by tile in parallel
+# Returns at most max_corners (points Nx2 float32, responses N float32), strongest first
+def extract_corners_tiled(gray, max_corners=100, corners_per_tile=None, quality_level=0.01, min_distance=10,
+                          tile_size=1024, overlap=None, workers=None):
+    height, width = gray.shape[:2]
+    overlap = min_distance * 2 if overlap is None else overlap
+    tiles = tile_grid(height, width, tile_size, overlap)
+    budget = corners_per_tile or max(1, math.ceil(max_corners / len(tiles)))
+
+    def process(tile):
+        core, (x0, y0, x1, y1) = tile
+        corners, quality = cv2.goodFeaturesToTrackWithQuality(gray[y0:y1, x0:x1], budget, quality_level,
+                                                              min_distance, None)
+        if corners is None or len(corners) == 0:
+            return np.empty((0, 2), dtype=np.float32), np.empty(0, dtype=np.float32)
+        points = corners.reshape(-1, 2) + (x0, y0)
+        keep = inside(points, core)
+        return points[keep].astype(np.float32), quality.reshape(-1)[keep].astype(np.float32)
+
+    results = run_tiles(process, tiles, workers)
+    points = np.concatenate([points for points, _ in results])
+    responses = np.concatenate([responses for _, responses in results])
+    # Tiles are rounded up, so the strongest max_corners of all tiles are kept
+    order = np.argsort(-responses, kind='stable')[:max_corners]
+    return points[order], responses[order]
+
+
+# Function to compute ORB features tile by tile in parallel
+# Returns (keypoints Nx7 float32 packed by keypoints_to_array, descriptors Nx32 uint8)
+def extract_orb_tiled(gray, features_per_tile=500, tile_size=1024, overlap=48, workers=None, **orb_params):
+    height, width = gray.shape[:2]
+    # The feature budget is set per tile
+    orb_params = {key: value for key, value in orb_params.items() if key != 'nfeatures'}
+    # The overlap must cover ORB's border and patch (edgeThreshold, patchSize) at the coarsest pyramid level,
+    # where they are scaleFactor ** (nlevels - 1) times larger in image pixels, otherwise features near
+    # the seams are lost or described differently than in the whole image
+    border = max(orb_params.get('edgeThreshold', 31), orb_params.get('patchSize', 31))
+    scale = orb_params.get('scaleFactor', 1.2) ** (orb_params.get('nlevels', 8) - 1)
+    overlap = max(overlap, math.ceil(border * scale) + 1)
+    tiles = tile_grid(height, width, tile_size, overlap)
+
+    def process(tile):
+        core, (x0, y0, x1, y1) = tile
+        orb = cv2.ORB_create(nfeatures=features_per_tile, **orb_params)
+        keypoints, descriptors = orb.detectAndCompute(gray[y0:y1, x0:x1], None)
+        if descriptors is None:
+            return np.empty((0, 7), dtype=np.float32), np.empty((0, 32), dtype=np.uint8)
+        packed = keypoints_to_array(keypoints)
+        packed[:, 0] += x0
+        packed[:, 1] += y0
+        keep = inside(packed, core)
+        return packed[keep], descriptors[keep]
+
+    results = run_tiles(process, tiles, workers)
+    return (np.concatenate([keypoints for keypoints, _ in results]),
+            np.concatenate([descriptors for _, descriptors in results]))
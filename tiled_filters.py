@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from tiled_features import tile_grid
+
+# Raw pixel layouts that can be memory-mapped as they are: PIL raw mode -> (channels, stored as RGB)
+MAPPABLE_MODES = {'L': (1, False), 'BGR': (3, False), 'RGB': (3, True)}
+
+
+# Function to open an image for tiled processing without decoding it into RAM where the format allows:
+# .npy files and uncompressed images stored as one raw block (BMP, PPM/PGM, some TIFF) are memory-mapped.
+# Other formats are decoded with cv2.imread. Returns an (H, W) or (H, W, 3) BGR uint8 array or view.
+def map_image(path):
+    if path.lower().endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    # Scans are far above PIL's decompression bomb limit; only the header is read here
+    Image.MAX_IMAGE_PIXELS = None
+    with Image.open(path) as image:
+        width, height = image.size
+        tiles = image.tile
+    if len(tiles) == 1 and tiles[0][0] == 'raw':
+        args = tiles[0][3]
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        if rawmode in MAPPABLE_MODES:
+            channels, rgb = MAPPABLE_MODES[rawmode]
+            stride = stride or width * channels
+            rows = np.memmap(path, dtype=np.uint8, mode='r', offset=tiles[0][2], shape=(height, stride))
+            array = rows[:, :width * channels]
+            if channels == 3:
+                array = array.reshape(height, width, 3)
+            if orientation == -1:
+                array = array[::-1]  # BMP rows are stored bottom-up
+            if rgb:
+                array = array[:, :, ::-1]
+            return array
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise IOError("Failed to read " + path)
+    return image
+
+
+# Function to create the output array; with a path it is a memory-mapped .npy file
+def create_output(shape, dtype=np.uint8, path=None):
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=tuple(shape))
+
+
+# Function to run a neighbourhood filter tile by tile in parallel
+# Every tile is read with a halo of `halo` pixels on each side (at least the filter radius), filtered,
+# and only its core is written to the output. Inside the image the core pixels see exactly the same
+# neighbourhood as in the whole image, and at the image borders the tile border is the image border,
+# so the stitched result has no seams and is identical to filtering the whole image at once.
+# function - takes a tile and returns the filtered tile of the same height and width
+def run_tiled(function, source, output, halo, tile_size=2048, workers=None):
+    height, width = source.shape[:2]
+
+    def process(tile):
+        (cx0, cy0, cx1, cy1), (x0, y0, x1, y1) = tile
+        # Only this tile is read from the memory-mapped source
+        result = function(np.ascontiguousarray(source[y0:y1, x0:x1]))
+        output[cy0:cy1, cx0:cx1] = result[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+
+    # OpenCV releases the GIL, so the tiles are filtered in threads and share the mapped arrays
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        list(executor.map(process, tile_grid(height, width, tile_size, halo)))
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output
+
+
+# Function to get the halo needed by a kernel of the given size: size (k) or shape (kh, kw)
+def kernel_halo(kernel_size):
+    sizes = kernel_size if isinstance(kernel_size, (tuple, list)) else (kernel_size,)
+    return max(sizes) // 2
@@ -0,0 +1,64 @@
+import tkinter as tk
+
+import numpy as np
+from PIL import Image, ImageTk
+
+from preview import PREVIEW_SIZE, make_proxy
+
+
+# Function to wrap an OpenCV image (gray, BGR or BGRA) into a PIL image
+# The channel order is swapped by PIL's raw decoder while the pixels are unpacked,
+# so color images need no separate cvtColor pass and gray images are not converted at all
+def to_pil(image):
+    image = np.ascontiguousarray(image)
+    size = (image.shape[1], image.shape[0])
+    if image.ndim == 2:
+        return Image.frombuffer("L", size, image, "raw", "L", 0, 1)
+    if image.shape[2] == 4:
+        return Image.frombuffer("RGBA", size, image, "raw", "BGRA", 0, 1)
+    return Image.frombuffer("RGB", size, image, "raw", "BGR", 0, 1)
+
+
+# Class for showing OpenCV images in a Canvas or a Label
+# One PhotoImage is kept per widget and updated in place with paste; a new one is created only
+# when the size or the mode of the shown image changes. On a canvas a single image item is reused,
+# so items do not pile up. Images larger than the widget are downscaled to fit it.
+class ImageDisplay:
+    def __init__(self, widget, max_size=None):
+        self.widget = widget
+        if max_size is None:
+            if isinstance(widget, tk.Canvas):
+                max_size = (int(widget.cget("width")), int(widget.cget("height")))
+            else:
+                max_size = PREVIEW_SIZE
+        self.max_size = max_size
+        self.photo = None
+        self.mode = None
+        self.item = None
+
+    def show(self, image):
+        pil_image = to_pil(make_proxy(image, self.max_size))
+        photo = self.photo
+        if photo is None or (photo.width(), photo.height()) != pil_image.size or self.mode != pil_image.mode:
+            self.photo = ImageTk.PhotoImage(pil_image.mode, pil_image.size)
+            self.mode = pil_image.mode
+            self.attach()
+        self.photo.paste(pil_image)
+
+    def attach(self):
+        if isinstance(self.widget, tk.Canvas):
+            if self.item is None:
+                self.item = self.widget.create_image(0, 0, anchor=tk.NW, image=self.photo)
+            else:
+                self.widget.itemconfig(self.item, image=self.photo)
+        else:
+            self.widget.config(image=self.photo)
+
+    def clear(self):
+        if isinstance(self.widget, tk.Canvas):
+            if self.item is not None:
+                self.widget.delete(self.item)
+            self.item = None
+        else:
+            self.widget.config(image="")
+        self.photo = None
@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+
+# Function to compute the 3x3 perspective matrix that maps four points onto four other points
+def perspective_matrix(src_points, dst_points):
+    rows = []
+    values = []
+    for (x, y), (u, v) in zip(src_points, dst_points):
+        rows.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        rows.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        values.extend([u, v])
+    coefficients = np.linalg.solve(np.array(rows, dtype=np.float64), np.array(values, dtype=np.float64))
+    return np.append(coefficients, 1).reshape(3, 3)
+
+
+# Class for a stack of geometric transforms composed into one homogeneous 3x3 matrix
+# The matrix maps source coordinates to output coordinates (pixel i covers [i, i + 1), as in PIL),
+# and every transform is given in the coordinates of the output of the previous ones.
+# The image is resampled only once, by render, however many transforms were added.
+class TransformStack:
+    def __init__(self, size):
+        self.source_size = tuple(size)
+        self.reset()
+
+    def reset(self):
+        self.matrix = np.eye(3)
+        self.size = self.source_size
+
+    def push(self, matrix, size=None):
+        self.matrix = np.asarray(matrix, dtype=np.float64) @ self.matrix
+        if size is not None:
+            self.size = (max(1, int(round(size[0]))), max(1, int(round(size[1]))))
+        return self
+
+    def scale(self, scale_x, scale_y=None):
+        scale_y = scale_x if scale_y is None else scale_y
+        width, height = self.size
+        return self.push(np.diag([scale_x, scale_y, 1.0]), (width * scale_x, height * scale_y))
+
+    # Method to scale the current output to the given size in pixels
+    def resize(self, width, height):
+        return self.scale(width / self.size[0], height / self.size[1])
+
+    # Method to rotate counter-clockwise by angle degrees around center (default - the center of the output),
+    # keeping the output size, as PIL's Image.rotate does
+    def rotate(self, angle, center=None):
+        if center is None:
+            center = (self.size[0] / 2.0, self.size[1] / 2.0)
+        cx, cy = center
+        cos_a = math.cos(math.radians(angle))
+        sin_a = math.sin(math.radians(angle))
+        return self.push([[cos_a, sin_a, cx - cos_a * cx - sin_a * cy],
+                          [-sin_a, cos_a, cy + sin_a * cx - cos_a * cy],
+                          [0, 0, 1]])
+
+    # Method to move the image content by (translate_x, translate_y) pixels
+    def translate(self, translate_x, translate_y):
+        return self.push([[1, 0, translate_x], [0, 1, translate_y], [0, 0, 1]])
+
+    def flip(self, direction):
+        width, height = self.size
+        if direction == "horizontal":
+            return self.push([[-1, 0, width], [0, 1, 0], [0, 0, 1]])
+        if direction == "vertical":
+            return self.push([[1, 0, 0], [0, -1, height], [0, 0, 1]])
+        raise ValueError("Unknown flip direction: " + str(direction))
+
+    # Method to map four points of the current output onto four other points; size - the new output size
+    def perspective(self, src_points, dst_points, size=None):
+        return self.push(perspective_matrix(src_points, dst_points), size)
+
+    # Method to project a quadrilateral of the current output (upper left, lower left, lower right,
+    # upper right corners, as in PIL's Image.QUAD) onto the whole output of the given size
+    def quad(self, points, size):
+        width, height = size
+        return self.perspective(points, [(0, 0), (0, height), (width, height), (width, 0)], size)
+
+    def is_identity(self):
+        return self.size == self.source_size and np.allclose(self.matrix, np.eye(3))
+
+    # Method to render the composed transform with a single resample of the source image
+    def render(self, image, resample=Image.BILINEAR):
+        if self.is_identity():
+            return image.copy()
+        matrix = self.matrix / self.matrix[2, 2]
+        width, height = self.source_size
+        # A pure change of size is done by resize, which also filters properly when downscaling
+        off_diagonal = matrix[~np.eye(3, dtype=bool)]
+        if np.allclose(off_diagonal, 0) and np.allclose([matrix[0, 0] * width, matrix[1, 1] * height], self.size):
+            return image.resize(self.size, resample)
+        # PIL expects the mapping from output to source coordinates
+        inverse = np.linalg.inv(matrix)
+        inverse /= inverse[2, 2]
+        if np.allclose(inverse[2, :2], 0):
+            return image.transform(self.size, Image.AFFINE, tuple(inverse[:2].ravel()), resample=resample)
+        return image.transform(self.size, Image.PERSPECTIVE, tuple(inverse.ravel()[:8]), resample=resample)
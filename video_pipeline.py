@@ -0,0 +1,108 @@
+import collections
+import queue
+import threading
+import time
+
+import cv2
+
+
+# Class for the threaded video pipeline: capture thread -> analysis thread -> display
+# The capture thread decodes frames into a bounded queue, the analysis thread runs the
+# selected analyzer on every frame, and the display side only takes the latest result.
+class VideoPipeline:
+    def __init__(self, source, queue_size=4, pace=True):
+        self.cap = cv2.VideoCapture(source)
+        self.frames = queue.Queue(maxsize=queue_size)
+        # Only the newest result is kept: older ones are dropped if the display is late
+        self.results = collections.deque(maxlen=1)
+        # Function frame -> processed frame (drawn in place), or None to show frames as is
+        self.analyzer = None
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.pace = pace
+        self.finished = False
+        # Exception raised by the analyzer; the pipeline stops and the display side reports it
+        self.error = None
+        self.stop_event = threading.Event()
+        self.capture_thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.worker_thread = threading.Thread(target=self.process_loop, daemon=True)
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def start(self):
+        self.capture_thread.start()
+        self.worker_thread.start()
+
+    # The capture is released by the capture thread when its loop exits, because after the join timeout
+    # the thread may still be inside cap.read(); here it is released only if the thread was never started
+    def stop(self):
+        self.stop_event.set()
+        for thread in (self.capture_thread, self.worker_thread):
+            if thread.is_alive():
+                thread.join(timeout=1.0)
+        if self.capture_thread.ident is None:
+            self.cap.release()
+
+    # Method to get the newest (original, processed) pair, or None if there is nothing new
+    def latest(self):
+        try:
+            return self.results.popleft()
+        except IndexError:
+            return None
+
+    # Method to put an item into the queue without blocking forever after stop()
+    def put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Capture thread: decodes frames at the source frame rate and releases the capture at the end
+    def capture_loop(self):
+        try:
+            self.read_frames()
+        finally:
+            self.cap.release()
+
+    def read_frames(self):
+        period = 1.0 / self.fps
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            if not self.put(frame):
+                return
+            if self.pace:
+                next_time = max(next_time + period, time.perf_counter() - period)
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        # None marks the end of the stream for the analysis thread
+        self.put(None)
+
+    # Analysis thread: runs the selected analyzer on every frame
+    def process_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                frame = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            analyzer = self.analyzer
+            processed = None
+            if analyzer is not None:
+                processed = frame.copy()
+                try:
+                    analyzer(processed)
+                except Exception as e:
+                    # The capture thread is stopped too, otherwise it waits in put() forever
+                    self.error = e
+                    self.stop_event.set()
+                    break
+            self.results.append((frame, processed))
+        self.finished = True